@@ -1,6 +1,19 @@
 # All time in seconds
-ITEM_CRAWL_TIME = 60 * 10  # Monitor loop time, if not using proxy
-UPDATE_TIME = 60 * 1  # Crawl item which updated before this time value
-Email_TIME = 10  # Send email sleep time
+ITEM_CRAWL_TIME = 60 * 10  # Reload monitored items from database every this time
+UPDATE_TIME = 60 * 1  # Crawl item which updated before this time value, also default crawl interval of scheduler
+Email_TIME = 10  # Min interval between two emails sent by the mail dispatcher
 PROXY_CRAWL = 0  # 0: Use local ip 1: Use proxy pool 2: Use zhi ma ip
 PROXY_POOL_IP = "127.0.0.1"  # Redis server ip
+PROXY_RETRIES = 2  # Proxy mode: an item without price is crawled again this many times, each with a new proxy
+CRAWLER_POOL_SIZE = 1  # Number of Chrome workers crawling in parallel, 1: serial crawl
+CRAWLER_LEAN = 0  # 1: Chrome blocks images, fonts, media and trackers and waits for price nodes only 0: Full page load
+HTTP_CRAWL_FIRST = 1  # 1: Try cheap HTTP crawler first, use Chrome only when it fails 0: Always use Chrome
+DB_BATCH_SIZE = 100  # Crawled items written to database in one transaction
+SCHEDULE_MIN_INTERVAL = 30  # Shortest crawl interval of volatile items or items close to user price
+SCHEDULE_MAX_INTERVAL = 60 * 30  # Longest crawl interval of stable items
+SCHEDULE_BATCH_SIZE = 50  # Max due items dispatched to crawlers at once
+EMAIL_DIGEST_TIME = 60 * 5  # Alerts of one user in this time are merged into one email, 0: send every loop
+WORK_LEASE = 0  # 1: Share the crawl with other nodes through leases in the database (use one MySQL for all nodes) 0: Single node
+LEASE_TTL = 60 * 5  # Lease of a crashed node is reclaimed by other nodes after this time
+PROFILE_ROUNDS = 5  # Rounds profiled after `kill -USR1 <pid>` or creating profile.ctl, reports in profile_reports/
+METRICS_PORT = 9108  # Prometheus metrics on http://127.0.0.1:METRICS_PORT/metrics, 0: disabled
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 # coding=utf-8
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, and_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
-from create_db import Base, User, Monitor
+from create_db import Base, User, Monitor, PriceHistory, PriceRollup, Lease, to_price
+from create_db import ROLLUP_HOUR, ROLLUP_DAY
 import datetime
-from CONFIG import UPDATE_TIME
+import time
+import uuid
+from decimal import Decimal
+from metrics import timed
 
 
 class Sql(object):
@@ -22,23 +27,27 @@ class Sql(object):
 
     def write_item(self, item_info):  # item_id, user_price, user_id
         time_now = datetime.datetime.now()
-        new_item = Monitor(item_id=item_info[0], user_price=item_info[1], user_id=item_info[2], status=1, add_time=time_now, update_time=time_now)
+        new_item = Monitor(item_id=item_info[0], user_price=to_price(item_info[1]), user_id=item_info[2], status=1, add_time=time_now, update_time=time_now)
         self.session.add(new_item)
         self.session.commit()
 
-    def read_all_not_updated_item(self):
-        time_now = datetime.datetime.now()
+    @timed('db_read_active_items')
+    def read_active_items(self):
+        # {item_id: (earliest update_time, highest user_price)} of active monitors, grouped in SQL
+        items = self.session.query(Monitor.item_id, func.min(Monitor.update_time).label('update_time'),
+                                   func.max(Monitor.user_price).label('user_price')).\
+            filter(Monitor.status == True).group_by(Monitor.item_id)
+        return {item.item_id: (item.update_time, to_price(item.user_price)) for item in items}
+
+    @timed('db_read_items')
+    def read_items_by_item_id(self, item_ids, batch_size=500):
+        # active [{column_id, item_id}, ...] of given item ids
         items_need = []
-        items_all = self.session.query(Monitor).all()
-        for item_all in items_all:
-            item_need = {}
-            if item_all.status == 1:
-                time_delta = (time_now - item_all.update_time).days * 86400 + (time_now - item_all.update_time).seconds
-                logging.info('%s\'s time delta: %s', item_all.item_id, time_delta)
-                if time_delta >= UPDATE_TIME:
-                    item_need['column_id'] = item_all.column_id
-                    item_need['item_id'] = item_all.item_id
-                    items_need.append(item_need)
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), batch_size):
+            items = self.session.query(Monitor.column_id, Monitor.item_id).\
+                filter(Monitor.item_id.in_(item_ids[i:i + batch_size]), Monitor.status == True)
+            items_need.extend({'column_id': item.column_id, 'item_id': item.item_id} for item in items)
         return items_need
 
     def update_item_name(self, column_id, item_name):
@@ -46,12 +55,17 @@ class Sql(object):
         update_item.item_name = item_name
         self.session.commit()
 
+    @timed('db_update_item_price')
     def update_item_price(self, column_id, item_price):
         time_now = datetime.datetime.now()
+        item_price = to_price(item_price)
+        if item_price is None:
+            logging.warning('Invalid price of %s: skip', column_id)
+            return
         update_item = self.session.query(Monitor).get(column_id)
         if update_item.item_price and update_item.item_price != item_price:  # if new price
             update_item.last_price = update_item.item_price
-            update_item.discount = round(float(item_price) / float(update_item.last_price), 2)  # round(,2) set to 0.01
+            update_item.discount = (item_price / update_item.last_price).quantize(Decimal('0.01'))  # set to 0.01
         update_item.item_price = item_price
         update_item.update_time = time_now
         self.session.commit()
@@ -63,40 +77,276 @@ class Sql(object):
 
     def update_item_plus_price(self, column_id, plus_price):
         update_item = self.session.query(Monitor).get(column_id)
-        update_item.plus_price = plus_price
+        update_item.plus_price = to_price(plus_price)
         self.session.commit()
 
     def update_item_max_price(self, column_id, highest_price):
         update_item = self.session.query(Monitor).get(column_id)
-        update_item.highest_price = highest_price
+        update_item.highest_price = to_price(highest_price)
         self.session.commit()
 
     def update_item_min_price(self, column_id, lowest_price):
         update_item = self.session.query(Monitor).get(column_id)
-        update_item.lowest_price = lowest_price
+        update_item.lowest_price = to_price(lowest_price)
+        self.session.commit()
+
+    @timed('db_update_items')
+    def update_items(self, items_info, batch_size=500):
+        """
+        Batched write path for one crawl round
+        items_info: {column_id: {item_name, item_price, highest_price, lowest_price}}, missing or empty field is not updated
+        Changed rows are written by one bulk update, rows without change only refresh update_time, in one transaction
+        :return: number of changed rows
+        """
+        time_now = datetime.datetime.now()
+        column_ids = list(items_info)
+        items_changed, items_touched = [], []
+        for i in range(0, len(column_ids), batch_size):
+            rows = self.session.query(Monitor.column_id, Monitor.item_name, Monitor.item_price,
+                                      Monitor.highest_price, Monitor.lowest_price).\
+                filter(Monitor.column_id.in_(column_ids[i:i + batch_size]))
+            for row in rows:
+                item_info = items_info[row.column_id]
+                item_changed = self._changed_fields(row, item_info)
+                price_crawled = to_price(item_info.get('item_price')) is not None  # update_time means price updated
+                if item_changed:
+                    item_changed['column_id'] = row.column_id
+                    if price_crawled:
+                        item_changed['update_time'] = time_now
+                    items_changed.append(item_changed)
+                elif price_crawled:
+                    items_touched.append(row.column_id)
+        if items_changed:
+            self.session.bulk_update_mappings(Monitor, items_changed)
+        for i in range(0, len(items_touched), batch_size):
+            self.session.query(Monitor).filter(Monitor.column_id.in_(items_touched[i:i + batch_size])).\
+                update({Monitor.update_time: time_now}, synchronize_session=False)
         self.session.commit()
+        logging.info('Batch update items: %s changed, %s unchanged', len(items_changed), len(items_touched))
+        return len(items_changed)
+
+    @staticmethod
+    def _changed_fields(row, item_info):
+        item_changed = {}
+        item_name = item_info.get('item_name')
+        if item_name and item_name != row.item_name:
+            item_changed['item_name'] = item_name
+        item_price = to_price(item_info.get('item_price'))
+        if item_price is not None and item_price != row.item_price:
+            if row.item_price:  # if new price
+                item_changed['last_price'] = row.item_price
+                item_changed['discount'] = (item_price / row.item_price).quantize(Decimal('0.01'))
+            item_changed['item_price'] = item_price
+        for field in ('highest_price', 'lowest_price'):
+            price = to_price(item_info.get(field))
+            if price is not None and price != getattr(row, field):
+                item_changed[field] = price
+        return item_changed
 
     def update_status(self, column_id):
         update_item = self.session.query(Monitor).get(column_id)
         update_item.status = 0
         self.session.commit()
 
-    def check_item_need_to_remind(self):
+    @timed('db_update_status')
+    def update_status_items(self, column_ids, batch_size=500):
+        # deactivate many monitors, one UPDATE ... IN for every batch_size rows, one commit
+        column_ids = list(column_ids)
+        for i in range(0, len(column_ids), batch_size):
+            self.session.query(Monitor).filter(Monitor.column_id.in_(column_ids[i:i + batch_size])).\
+                update({Monitor.status: False}, synchronize_session=False)
+        self.session.commit()
+
+    @timed('db_price_history')
+    def write_price_history(self, prices, ts=None, batch_size=500):
+        """
+        Append observed prices to price history, only prices changed since last observation are written
+        Hourly and daily rollups are updated with every observation
+        :param prices: {item_id: price}
+        :return: number of history rows written
+        """
+        ts = int(ts or time.time())
+        prices_cents = {}
+        for item_id, price in prices.items():
+            price = to_price(price)
+            if price is not None and price >= 0:
+                prices_cents[int(item_id)] = int(price * 100)
+        item_ids = list(prices_cents)
+        written = 0
+        for i in range(0, len(item_ids), batch_size):
+            chunk = item_ids[i:i + batch_size]
+            last = self._read_last_prices(chunk)
+            for item_id in chunk:
+                last_ts, last_cents = last.get(item_id, (None, None))
+                if last_cents == prices_cents[item_id]:
+                    continue
+                if last_ts == ts:
+                    # observed twice within one second, (item_id, ts) is taken, the later price wins
+                    self.session.query(PriceHistory).filter(PriceHistory.item_id == item_id, PriceHistory.ts == ts).\
+                        update({PriceHistory.price_cents: prices_cents[item_id]}, synchronize_session=False)
+                else:
+                    self.session.add(PriceHistory(item_id=item_id, ts=ts, price_cents=prices_cents[item_id]))
+                written += 1
+            for period in (ROLLUP_HOUR, ROLLUP_DAY):
+                self._update_rollup(chunk, prices_cents, period, ts)
+            self.session.commit()
+        logging.info('Price history: %s observed, %s changed', len(item_ids), written)
+        return written
+
+    def _read_last_prices(self, item_ids):
+        # {item_id: (ts, price_cents)} of latest rows, primary key (item_id, ts) serves both the max and the join
+        latest = self.session.query(PriceHistory.item_id, func.max(PriceHistory.ts).label('ts')).\
+            filter(PriceHistory.item_id.in_(item_ids)).group_by(PriceHistory.item_id).subquery()
+        rows = self.session.query(PriceHistory.item_id, PriceHistory.ts, PriceHistory.price_cents).\
+            join(latest, and_(PriceHistory.item_id == latest.c.item_id, PriceHistory.ts == latest.c.ts))
+        return {row.item_id: (row.ts, row.price_cents) for row in rows}
+
+    @staticmethod
+    def bucket_start(ts, period):
+        # buckets are aligned to local time, so daily bucket starts at local midnight
+        return ts - (ts - time.timezone) % period
+
+    def _update_rollup(self, item_ids, prices_cents, period, ts):
+        bucket_ts = self.bucket_start(ts, period)
+        rollups = self.session.query(PriceRollup).\
+            filter(PriceRollup.period == period, PriceRollup.bucket_ts == bucket_ts, PriceRollup.item_id.in_(item_ids))
+        rollups = {rollup.item_id: rollup for rollup in rollups}
+        for item_id in item_ids:
+            cents = prices_cents[item_id]
+            rollup = rollups.get(item_id)
+            if rollup is None:
+                self.session.add(PriceRollup(item_id=item_id, period=period, bucket_ts=bucket_ts, min_cents=cents,
+                                             max_cents=cents, last_cents=cents, last_ts=ts))
+            elif ts >= rollup.last_ts and cents != rollup.last_cents:  # unchanged price needs no write
+                rollup.min_cents = min(rollup.min_cents, cents)
+                rollup.max_cents = max(rollup.max_cents, cents)
+                rollup.last_cents = cents
+                rollup.last_ts = ts
+
+    def read_price_rollup(self, item_id, start_ts, end_ts, period=ROLLUP_DAY):
+        """
+        Price trend of item between start_ts and end_ts, read from rollups only
+        :return: [{bucket_ts, min_price, max_price, last_price}, ...], buckets without observation are missing
+        """
+        rollups = self.session.query(PriceRollup).\
+            filter(PriceRollup.item_id == int(item_id), PriceRollup.period == period,
+                   PriceRollup.bucket_ts >= self.bucket_start(int(start_ts), period),
+                   PriceRollup.bucket_ts <= int(end_ts)).order_by(PriceRollup.bucket_ts)
+        return [{'bucket_ts': rollup.bucket_ts, 'min_price': Decimal(rollup.min_cents) / 100,
+                 'max_price': Decimal(rollup.max_cents) / 100, 'last_price': Decimal(rollup.last_cents) / 100}
+                for rollup in rollups]
+
+    @timed('db_claim_leases')
+    def claim_leases(self, names, owner, ttl, batch_size=500):
+        """
+        Claim free leases for owner until now + ttl, one conditional UPDATE per batch so every lease is taken
+        by one node only; names never seen are inserted first, one INSERT per batch
+        :return: {name: previous owner} of claimed leases, previous owner not None means reclaimed from a dead node
+        """
+        now = int(time.time())
+        names = list(names)
+        claimed = {}
+        for i in range(0, len(names), batch_size):
+            chunk = names[i:i + batch_size]
+            previous = {row.name: row.owner for row in
+                        self.session.query(Lease.name, Lease.owner).filter(Lease.name.in_(chunk))}
+            new_names = [name for name in chunk if name not in previous]
+            if new_names:
+                self._insert_leases(new_names)
+                previous.update((name, None) for name in new_names)
+            token = uuid.uuid4().hex
+            self.session.query(Lease).filter(Lease.name.in_(chunk), Lease.expire_ts <= now).\
+                update({Lease.owner: owner, Lease.token: token, Lease.expire_ts: now + ttl},
+                       synchronize_session=False)
+            self.session.commit()
+            for row in self.session.query(Lease.name).filter(Lease.name.in_(chunk), Lease.token == token):
+                claimed[row.name] = previous.get(row.name)
+        return claimed
+
+    def _insert_leases(self, names):
+        # one INSERT for the chunk, rows inserted by another node at the same time are skipped
+        insert = Lease.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite').\
+            prefix_with('IGNORE', dialect='mysql')
+        rows = [{'name': name, 'expire_ts': 0} for name in names]
+        try:
+            self.session.execute(insert, rows)
+            self.session.commit()
+        except IntegrityError:  # dialect without insert-or-ignore, retry row by row
+            self.session.rollback()
+            for row in rows:
+                try:
+                    self.session.execute(Lease.__table__.insert(), row)
+                    self.session.commit()
+                except IntegrityError:
+                    self.session.rollback()
+
+    @timed('db_renew_leases')
+    def renew_leases(self, names, owner, ttl, batch_size=500):
+        # extend leases still held by owner, :return: set of names still held
+        expire_ts = int(time.time()) + ttl
+        names = list(names)
+        held = set()
+        for i in range(0, len(names), batch_size):
+            chunk = names[i:i + batch_size]
+            self.session.query(Lease).filter(Lease.name.in_(chunk), Lease.owner == owner).\
+                update({Lease.expire_ts: expire_ts}, synchronize_session=False)
+            self.session.commit()
+            held.update(row.name for row in
+                        self.session.query(Lease.name).filter(Lease.name.in_(chunk), Lease.owner == owner))
+        return held
+
+    @timed('db_release_leases')
+    def release_leases(self, leases, owner):
+        """
+        Release leases held by owner
+        :param leases: {name: free_ts}, lease can be claimed again from free_ts, 0 for at once
+        """
+        for name, free_ts in leases.items():
+            self.session.query(Lease).filter(Lease.name == name, Lease.owner == owner).\
+                update({Lease.owner: None, Lease.token: None, Lease.expire_ts: int(free_ts)},
+                       synchronize_session=False)
+        self.session.commit()
+
+    def read_leases_free_ts(self, names, batch_size=500):
+        # {name: unix timestamp from which lease can be claimed}
+        names = list(names)
+        free_ts = {}
+        for i in range(0, len(names), batch_size):
+            rows = self.session.query(Lease.name, Lease.expire_ts).filter(Lease.name.in_(names[i:i + batch_size]))
+            free_ts.update((row.name, row.expire_ts) for row in rows)
+        return free_ts
+
+    @timed('alert_pass')
+    def check_item_need_to_remind(self, item_ids=None, batch_size=500):
+        """
+        :param item_ids: only check monitors of these items, all active monitors if None
+        """
         # items_alert = {column_id, item_id, user_price, item_price, name, email}
+        if item_ids is None:
+            return self._read_items_alert()
+        item_ids = [int(item_id) for item_id in item_ids]
+        items_alert = []
+        for i in range(0, len(item_ids), batch_size):
+            items_alert.extend(self._read_items_alert(Monitor.item_id.in_(item_ids[i:i + batch_size])))
+        return items_alert
+
+    def _read_items_alert(self, *criterion):
+        # one joined query, numeric prices are compared in SQL
+        items = self.session.query(Monitor.column_id, Monitor.item_id, Monitor.item_name, Monitor.item_price,
+                                   Monitor.user_price, User.email).\
+            join(User, Monitor.user_id == User.column_id).\
+            filter(Monitor.status == True, Monitor.user_price != None, Monitor.item_price != None,
+                   Monitor.user_price > Monitor.item_price, *criterion)
         items_alert = []
-        items = self.session.query(Monitor).all()
         for item in items:
             item_alert = {}
-            if item.status == 1 and item.user_price:
-                if float(item.user_price) > float(item.item_price):
-                    user = self.session.query(User).filter_by(column_id=item.user_id)
-                    item_alert['email'] = user[0].email
-                    item_alert['name'] = item.item_name
-                    item_alert['item_price'] = item.item_price
-                    item_alert['user_price'] = item.user_price
-                    item_alert['item_id'] = item.item_id
-                    item_alert['column_id'] = item.column_id
-                    items_alert.append(item_alert)
+            item_alert['email'] = item.email
+            item_alert['name'] = item.item_name
+            item_alert['item_price'] = item.item_price
+            item_alert['user_price'] = item.user_price
+            item_alert['item_id'] = item.item_id
+            item_alert['column_id'] = item.column_id
+            items_alert.append(item_alert)
         return items_alert
 
 
@@ -111,6 +361,6 @@ if __name__ == '__main__':
     # item_id, user_price, user_id
     sql.write_item(['100005857580', '2000', '1'])
 
-    # read all items needed update
-    # print(sql.read_all_not_updated_item())
+    # read all active items grouped by item_id
+    # print(sql.read_active_items())
 
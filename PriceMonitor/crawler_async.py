@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import asyncio
+import logging
+import aiohttp
+from crawler_js import Crawler, PRICE_BATCH_SIZE, NAME_FAILURE
+
+CONCURRENCY_LIMIT = 100  # Max concurrent requests of one AsyncCrawler
+PER_HOST_LIMIT = 10  # Max concurrent keep-alive connections to one host
+REQUEST_TIMEOUT = 5  # Timeout of one request
+
+
+class AsyncCrawler(object):
+    """
+    Asyncio version of crawler_js.Crawler, requests share one session with pooled keep-alive connections
+    Return the same values as crawler_js.Crawler
+
+    async with AsyncCrawler() as cr:
+        price = await cr.get_price_jd('2777811', header)
+    """
+
+    def __init__(self, concurrency=CONCURRENCY_LIMIT, per_host=PER_HOST_LIMIT, timeout=REQUEST_TIMEOUT):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        # connector keeps connections alive and limits them globally and per host
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    @staticmethod
+    def _proxy_url(proxy):
+        # requests style proxy dict to aiohttp proxy url, aiohttp only supports http proxies
+        if not proxy:
+            return None
+        proxy_url = proxy.get('http') or proxy.get('https')
+        if '://' not in proxy_url:
+            proxy_url = 'http://' + proxy_url
+        return proxy_url
+
+    async def _get(self, url, header, proxy=None, timeout=None):
+        """
+        :return: response text, None on network error
+        """
+        timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        try:
+            async with self._semaphore:
+                async with self.session.get(url, headers=header, proxy=self._proxy_url(proxy),
+                                            timeout=timeout) as r:
+                    return await r.text(errors='ignore')
+        except aiohttp.ClientProxyConnectionError as e:
+            logging.info('Proxy error: %s', e)
+        except aiohttp.ClientConnectionError as e:
+            logging.info('Https error: %s', e)
+        except asyncio.TimeoutError as e:
+            logging.info('Timeout error: %s', e)
+        except aiohttp.ClientPayloadError as e:
+            logging.info('ClientPayloadError error: %s', e)
+        except aiohttp.ClientError as e:  # bad status, too many redirects, invalid url...
+            logging.info('Http error: %s', e)
+        return None
+
+    async def get_info_huihui(self, item_id, header, proxy=None):
+        url = Crawler.url_info_huihui(item_id)
+        logging.debug('Ready to crawl huihui price URL：%s', url)
+        text = await self._get(url, header, proxy)
+        if text is None:
+            return False
+        try:
+            return Crawler.parse_info_huihui(text)
+        except (ValueError, KeyError) as e:
+            logging.info('Huihui error: %s', e)
+            return False
+
+    async def get_subtitle_jd(self, item_id, header, proxy=None):
+        url = Crawler.url_subtitle_jd(item_id)
+        logging.debug('Ready to crawl jd subtitle URL：%s', url)
+        text = await self._get(url, header, proxy)
+        if text is None:
+            return False
+        return Crawler.parse_subtitle_jd(text)
+
+    async def get_price_jd(self, item_id, header, proxy=None):
+        url = Crawler.url_prices_jd([item_id])
+        logging.debug('Ready to crawl JD price URL：%s', url)
+        text = await self._get(url, header, proxy)
+        if text is None:
+            return False
+        return Crawler.parse_price_jd(text, item_id)
+
+    async def get_prices_jd(self, item_ids, header, proxy=None, chunk_size=PRICE_BATCH_SIZE):
+        """
+        Same as crawler_js.Crawler.get_prices_jd, chunks are requested concurrently
+        :return: {item_id: price}, price is '-1' for invalid item id and False for crawl failure
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        chunks = [item_ids[i:i + chunk_size] for i in range(0, len(item_ids), chunk_size)]
+        prices_chunks = await asyncio.gather(*[self._get_prices_chunk(chunk, header, proxy) for chunk in chunks])
+        prices = {}
+        for chunk, prices_chunk in zip(chunks, prices_chunks):
+            if prices_chunk is None:  # whole chunk rejected, find out the invalid ids one by one
+                logging.info('Invalid item id in chunk, crawling one by one: %s', chunk)
+                prices_one = await asyncio.gather(*[self.get_price_jd(item_id, header, proxy) for item_id in chunk])
+                prices_chunk = dict(zip(chunk, prices_one))
+            prices.update(prices_chunk)
+        return prices
+
+    async def _get_prices_chunk(self, item_ids, header, proxy=None):
+        url = Crawler.url_prices_jd(item_ids)
+        logging.debug('Ready to crawl JD prices URL：%s', url)
+        text = await self._get(url, header, proxy)
+        if text is None:
+            return {item_id: False for item_id in item_ids}
+        try:
+            return Crawler.parse_prices_jd(text, item_ids)
+        except Exception as e:  # unexpected response, e.g. a json without ids
+            logging.info('Prices parse error: %s', e)
+            return {item_id: False for item_id in item_ids}
+
+    async def get_name_jd(self, item_id, header, proxy=None):
+        url = Crawler.url_name_jd(item_id)
+        logging.debug('Ready to crawl JD name URL：%s', url)
+        text = await self._get(url, header, proxy, timeout=6)
+        if text is None:
+            return ''  # as False
+        try:
+            return Crawler.parse_name_jd(text)
+        except Exception as e:  # e.g. empty page body
+            logging.info('Name parse error: %s, %s', item_id, e)
+            return NAME_FAILURE
+
+    async def get_items_info(self, item_ids, header, proxy=None):
+        """
+        Crawl name, price and huihui history price of many items at once
+        :return: {item_id: {title, price, max_price, min_price}}, failed fields are False/''/NAME_FAILURE,
+                 an error of one item only fails that item
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        prices, names, huihui_infos = await asyncio.gather(
+            self.get_prices_jd(item_ids, header, proxy),
+            asyncio.gather(*[self.get_name_jd(item_id, header, proxy) for item_id in item_ids],
+                           return_exceptions=True),
+            asyncio.gather(*[self.get_info_huihui(item_id, header, proxy) for item_id in item_ids],
+                           return_exceptions=True),
+            return_exceptions=True)
+        if isinstance(prices, Exception):
+            logging.warning('Prices crawl error: %s', prices)
+            prices = {}
+        items_info = {}
+        for item_id, name, huihui_info in zip(item_ids, names, huihui_infos):
+            if isinstance(name, Exception):
+                logging.warning('Name crawl error: %s, %s', item_id, name)
+                name = NAME_FAILURE
+            if isinstance(huihui_info, Exception):
+                logging.warning('Huihui crawl error: %s, %s', item_id, huihui_info)
+                huihui_info = False
+            max_price, min_price = huihui_info if huihui_info else (None, None)
+            items_info[item_id] = {'title': name, 'price': prices.get(item_id, False),
+                                   'max_price': max_price, 'min_price': min_price}
+        return items_info
+
+
+def crawl_items_info(item_ids, header, proxy=None, **kwargs):
+    """
+    Blocking entry for the sync monitor loop, run AsyncCrawler.get_items_info in a new event loop
+    """
+    async def _crawl():
+        async with AsyncCrawler(**kwargs) as cr:
+            return await cr.get_items_info(item_ids, header, proxy)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_crawl())
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # logging.debug(crawl_items_info(['2777811', '5181380'], {'user-agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) '
+    #                                                                      'AppleWebKit/536.6 (KHTML, like Gecko) '
+    #                                                                      'Chrome/20.0.1092.0 Safari/536.6'}))
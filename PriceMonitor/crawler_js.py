@@ -5,12 +5,15 @@ import json
 from lxml import etree
 import logging
 
+PRICE_BATCH_SIZE = 50  # Max item ids in one mgets request
+NAME_FAILURE = '本轮抓取该商品名称失败，请等待重试'  # Name returned when page has no name, e.g. captcha
+
 
 class Crawler(object):
 
     @staticmethod
     def get_info_huihui(item_id, header, proxy=None):
-        url = 'https://zhushou.huihui.cn/productSense?phu=https://item.jd.com/' + item_id + '.html'
+        url = Crawler.url_info_huihui(item_id)
         logging.debug('Ready to crawl huihui price URL：%s', url)
         try:
             if proxy:  # Using proxy
@@ -19,10 +22,7 @@ class Crawler(object):
             else:  # Not using proxy
                 logging.info('Not using proxy to crawl huihui')
                 r = requests.get(url, headers=header, timeout=5)
-            max_price = r.json()['max']
-            min_price = r.json()['min']
-            logging.info('max and min price: %s, %s', max_price, min_price)
-            return max_price, min_price
+            return Crawler.parse_info_huihui(r.text)
 
         except requests.exceptions.ProxyError as e:
             logging.info('Proxy error: %s', e)
@@ -39,8 +39,7 @@ class Crawler(object):
 
     @staticmethod
     def get_subtitle_jd(item_id, header, proxy=None):
-        url = 'https://cd.jd.com/promotion/v2?callback=jQuery6525446&skuId=' + item_id + \
-              '5181380&area=1_72_2799_0&shopId=1000000904&venderId=1000000904&cat=9987%2C653%2C655'
+        url = Crawler.url_subtitle_jd(item_id)
         logging.debug('Ready to crawl jd subtitle URL：%s', url)
         try:
             if proxy:  # Using proxy
@@ -49,16 +48,7 @@ class Crawler(object):
             else:  # Not using proxy
                 logging.info('Not using proxy to crawl subtitle')
                 r = requests.get(url, headers=header, timeout=5)
-            subtitle = r.text
-            try:
-                subtitle = subtitle[14:-1]
-                print(subtitle)
-                subtitle_js = json.loads(str(subtitle))
-            except json.decoder.JSONDecodeError as e:
-                logging.info('Captcha error: %s', e)
-                return False
-            logging.info('subtitle: %s, %s', subtitle)
-            return subtitle_js['ads'][0]['ad']
+            return Crawler.parse_subtitle_jd(r.text)
         except requests.exceptions.ProxyError as e:
             logging.info('Proxy error: %s', e)
             return False
@@ -74,7 +64,7 @@ class Crawler(object):
 
     @staticmethod
     def get_price_jd(item_id, header, proxy=None):
-        url = 'https://p.3.cn/prices/mgets?callback=&skuIds=J_' + item_id
+        url = Crawler.url_prices_jd([item_id])
         logging.debug('Ready to crawl JD price URL：%s', url)
         try:
             if proxy:  # Using proxy
@@ -83,19 +73,7 @@ class Crawler(object):
             else:  # Not using proxy
                 logging.info('Not using proxy to crawl price')
                 r = requests.get(url, headers=header, timeout=5)
-            price = r.text
-            # can not use status code because wrong id also get 200
-            if price == 'skuids input error\n':  # Avoid invalid item id
-                js_fake = '-1'
-                return js_fake
-            try:
-                price = price[2:-4]
-                price_js = json.loads(str(price))
-            except json.decoder.JSONDecodeError as e:
-                logging.info('Captcha error: %s', e)
-                return False
-            logging.info('Item: %s ,price JS: %s', item_id, price_js)
-            return price_js['p']
+            return Crawler.parse_price_jd(r.text, item_id)
         except requests.exceptions.ProxyError as e:
             logging.info('Proxy error: %s', e)
             return False
@@ -109,9 +87,54 @@ class Crawler(object):
             logging.info('ChunkedEncodingError error: %s', e)
             return False
 
+    @classmethod
+    def get_prices_jd(cls, item_ids, header, proxy=None, chunk_size=PRICE_BATCH_SIZE):
+        """
+        Batch crawl prices through mgets, one request for every chunk_size item ids
+        :return: {item_id: price}, price is '-1' for invalid item id and False for crawl failure
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        prices = {}
+        for i in range(0, len(item_ids), chunk_size):
+            chunk = item_ids[i:i + chunk_size]
+            prices_chunk = cls._get_prices_chunk(chunk, header, proxy)
+            if prices_chunk is None:  # whole chunk rejected, find out the invalid ids one by one
+                logging.info('Invalid item id in chunk, crawling one by one: %s', chunk)
+                prices_chunk = {item_id: cls.get_price_jd(item_id, header, proxy) for item_id in chunk}
+            prices.update(prices_chunk)
+        return prices
+
+    @staticmethod
+    def _get_prices_chunk(item_ids, header, proxy=None):
+        """
+        :return: {item_id: price}, or None if the endpoint rejects the chunk as skuids input error
+        """
+        url = Crawler.url_prices_jd(item_ids)
+        logging.debug('Ready to crawl JD prices URL：%s', url)
+        failure = {item_id: False for item_id in item_ids}
+        try:
+            if proxy:  # Using proxy
+                r = requests.get(url, headers=header, proxies=proxy, timeout=5)
+            else:  # Not using proxy
+                logging.info('Not using proxy to crawl prices')
+                r = requests.get(url, headers=header, timeout=5)
+            return Crawler.parse_prices_jd(r.text, item_ids)
+        except requests.exceptions.ProxyError as e:
+            logging.info('Proxy error: %s', e)
+            return failure
+        except requests.exceptions.ConnectionError as e:
+            logging.info('Https error: %s', e)
+            return failure
+        except requests.exceptions.ReadTimeout as e:
+            logging.info('Timeout error: %s', e)
+            return failure
+        except requests.exceptions.ChunkedEncodingError as e:
+            logging.info('ChunkedEncodingError error: %s', e)
+            return failure
+
     @staticmethod
     def get_name_jd(item_id, header, proxy=None):
-        url = 'https://item.jd.com/' + item_id + '.html'
+        url = Crawler.url_name_jd(item_id)
         logging.debug('Ready to crawl JD name URL：%s', url)
         try:
             if proxy:  # Using proxy
@@ -120,26 +143,7 @@ class Crawler(object):
             else:  # Not using proxy
                 logging.info('Not using proxy to crawl name')
                 r = requests.get(url, headers=header, timeout=6)
-            selector = etree.HTML(r.text)
-            name = selector.xpath("//*[@class='sku-name']/text()")  # list
-            try:  # normal
-                name_true = name[0].strip()
-                if not len(name_true):  # jd chaoshi
-                    logging.info('Change method to catch name: jd chaoshi')
-                    name_true = name[1].strip()
-            except IndexError as e:
-                logging.info(e, name)
-                logging.info('Change method to catch name: jd jingxuan')
-                try:  # jd jingxuan
-                    name = selector.xpath("//*[@id='name']/h1/text()")
-                    name_true = name[0].strip()
-                except IndexError as e:
-                    logging.warning(e, name)
-                    logging.warning('Catch name error')
-                    name_true = '本轮抓取该商品名称失败，请等待重试'
-                    return name_true
-            logging.info('Item: %s', name_true)
-            return name_true
+            return Crawler.parse_name_jd(r.text)
         except requests.exceptions.ProxyError as e:
             logging.info('Proxy error: %s', e)
             return ''  # as False
@@ -153,6 +157,105 @@ class Crawler(object):
             logging.info('ChunkedEncodingError error: %s', e)
             return ''  # as False
 
+    # URL builders and response parsers, shared with crawler_async
+
+    @staticmethod
+    def url_info_huihui(item_id):
+        return 'https://zhushou.huihui.cn/productSense?phu=https://item.jd.com/' + item_id + '.html'
+
+    @staticmethod
+    def url_subtitle_jd(item_id):
+        return 'https://cd.jd.com/promotion/v2?callback=jQuery6525446&skuId=' + item_id + \
+               '5181380&area=1_72_2799_0&shopId=1000000904&venderId=1000000904&cat=9987%2C653%2C655'
+
+    @staticmethod
+    def url_prices_jd(item_ids):
+        return 'https://p.3.cn/prices/mgets?callback=&skuIds=' + ','.join('J_' + item_id for item_id in item_ids)
+
+    @staticmethod
+    def url_name_jd(item_id):
+        return 'https://item.jd.com/' + item_id + '.html'
+
+    @staticmethod
+    def parse_info_huihui(text):
+        info_js = json.loads(text)
+        max_price = info_js['max']
+        min_price = info_js['min']
+        logging.info('max and min price: %s, %s', max_price, min_price)
+        return max_price, min_price
+
+    @staticmethod
+    def parse_subtitle_jd(text):
+        try:
+            subtitle = text[14:-1]
+            subtitle_js = json.loads(str(subtitle))
+        except json.decoder.JSONDecodeError as e:
+            logging.info('Captcha error: %s', e)
+            return False
+        logging.info('subtitle: %s', subtitle)
+        return subtitle_js['ads'][0]['ad']
+
+    @staticmethod
+    def parse_price_jd(text, item_id):
+        # can not use status code because wrong id also get 200
+        if text == 'skuids input error\n':  # Avoid invalid item id
+            js_fake = '-1'
+            return js_fake
+        try:
+            price = text[2:-4]
+            price_js = json.loads(str(price))
+        except json.decoder.JSONDecodeError as e:
+            logging.info('Captcha error: %s', e)
+            return False
+        logging.info('Item: %s ,price JS: %s', item_id, price_js)
+        return price_js['p']
+
+    @staticmethod
+    def parse_prices_jd(text, item_ids):
+        """
+        :return: {item_id: price}, or None if the endpoint rejects the chunk as skuids input error
+        """
+        # can not use status code because wrong id also get 200
+        if text == 'skuids input error\n':
+            if len(item_ids) == 1:  # Avoid invalid item id
+                return {item_ids[0]: '-1'}
+            return None
+        try:
+            prices_js = json.loads(text[text.index('['):text.rindex(']') + 1])
+        except ValueError as e:
+            logging.info('Captcha error: %s', e)
+            return {item_id: False for item_id in item_ids}
+        logging.info('Prices JS: %s', prices_js)
+        prices_dict = {price_js['id'][2:]: price_js['p'] for price_js in prices_js}
+        # ids missing in response are invalid
+        return {item_id: prices_dict.get(item_id, '-1') for item_id in item_ids}
+
+    @staticmethod
+    def parse_name_jd(text):
+        selector = etree.HTML(text)
+        if selector is None:  # empty page
+            logging.warning('Catch name error: empty page')
+            return NAME_FAILURE
+        name = selector.xpath("//*[@class='sku-name']/text()")  # list
+        try:  # normal
+            name_true = name[0].strip()
+            if not len(name_true):  # jd chaoshi
+                logging.info('Change method to catch name: jd chaoshi')
+                name_true = name[1].strip()
+        except IndexError as e:
+            logging.info('%s, %s', e, name)
+            logging.info('Change method to catch name: jd jingxuan')
+            try:  # jd jingxuan
+                name = selector.xpath("//*[@id='name']/h1/text()")
+                name_true = name[0].strip()
+            except IndexError as e:
+                logging.warning('%s, %s', e, name)
+                logging.warning('Catch name error')
+                name_true = NAME_FAILURE
+                return name_true
+        logging.info('Item: %s', name_true)
+        return name_true
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
@@ -160,6 +263,9 @@ if __name__ == '__main__':
     # logging.debug(c.get_price_jd('2777811', {'user-agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) '
     #                                                    'AppleWebKit/536.6 (KHTML, like Gecko) '
     #                                                    'Chrome/20.0.1092.0 Safari/536.6'}))
+    # logging.debug(c.get_prices_jd(['2777811', '5181380'], {'user-agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) '
+    #                                                                 'AppleWebKit/536.6 (KHTML, like Gecko) '
+    #                                                                 'Chrome/20.0.1092.0 Safari/536.6'}))
     # logging.debug(c.get_name_jd('2777811', {'user-agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) '
     #                                                       'AppleWebKit/536.6 (KHTML, like Gecko) '
     #                                                       'Chrome/20.0.1092.0 Safari/536.6'}))
@@ -7,14 +7,84 @@ from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, StaleElementReferenceException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import time
 import json
 import random
 import os
-import pickle
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+try:
+    from metrics import inc, timer, timed
+    from session import CookieSession
+except ImportError:  # imported as PriceMonitor.crawler_selenium
+    from .metrics import inc, timer, timed
+    from .session import CookieSession
+
+# 精简模式下通过 DevTools 拦截的资源：图片、字体、音视频以及广告和统计脚本，价格和优惠券不依赖它们
+LEAN_BLOCKED_URLS = [
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.svg', '*.ico', '*.avif',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.flv',
+    '*.doubleclick.net*', '*googlesyndication.com*', '*google-analytics.com*',
+    '*hm.baidu.com*', '*cnzz.com*', '*mercury.jd.com*', '*knicks.jd.com*', '*blackhole.m.jd.com*',
+    '*x-api.jd.com/log*', '*gia.jd.com*', '*ads.jd.com*',
+]
+# 与原 XPath //span[contains(@class,'p-price')]/span[contains(@class,'price')] 相同，按 class 子串匹配
+PRICE_SELECTOR = 'span[class*="p-price"] > span[class*="price"]'
+COUPON_SELECTOR = 'div.coupons-list-box'
+
+# 一次 execute_script 取回解析商品页需要的全部内容，避免每个节点、每个优惠券字段一次 WebDriver 往返
+EXTRACT_PAGE_JS = '''
+    var text = function (root, selector) {
+        var el = root.querySelector(selector);
+        return el ? (el.innerText || '').trim() : '';
+    };
+    var prices = [];
+    document.querySelectorAll(arguments[0]).forEach(function (el) {
+        prices.push((el.innerText || '').trim());
+    });
+    var box = document.querySelector(arguments[1]);
+    var coupons = [];
+    if (box) {
+        box.querySelectorAll('.coupon-quan').forEach(function (cq) {
+            coupons.push({
+                price: text(cq, '.coupon-quan-left-price'),
+                condition: text(cq, '.coupon-quan-right-price'),
+                expire: text(cq, '.coupon-quan-right-font')
+            });
+        });
+    }
+    return {
+        url: location.href,
+        title: document.title,
+        need_login: document.documentElement.outerHTML.indexOf('请登录') !== -1,
+        prices: prices,
+        has_coupon_box: !!box,
+        coupons: coupons
+    };
+'''
+PRICE_READY_JS = '''
+    if (location.href.indexOf('https://item.jd.com/') !== 0) return true;
+    var els = document.querySelectorAll(arguments[0]);
+    for (var i = 0; i < els.length; i++) {
+        if (/^\\d+(\\.\\d+)?$/.test((els[i].innerText || '').trim().replace('￥', '').replace(/,/g, ''))) return true;
+    }
+    return false;
+'''
+COUPON_READY_JS = 'return !!document.querySelector(arguments[0]);'
+CLICK_MORE_JS = '''
+    var btn = document.querySelector('span.more-btn');
+    if (btn && btn.offsetParent !== null) { btn.click(); return true; }
+    return false;
+'''
+# 京东首页上未登录时出现的标识
+NOT_LOGGED_IN_JS = '''
+    var html = document.documentElement.outerHTML;
+    return ['请登录', '登录注册', 'login-tab-r', '登录京东'].some(function (s) { return html.indexOf(s) !== -1; });
+'''
 
 
 class Crawler(object):
@@ -22,14 +92,24 @@ class Crawler(object):
     _chrome = None
 
     def __new__(cls, *args, **kwargs):
+        # standalone 实例由 CrawlerPool 使用，每个都拥有独立的浏览器，不占用单例
+        if kwargs.get('standalone'):
+            return super().__new__(cls)
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, proxy=None, skip_cookies=False, cookies_file=None):
+    def __init__(self, proxy=None, skip_cookies=False, cookies_file=None, standalone=False, lean=False):
+        """
+        :param lean: 精简模式，拦截图片、字体、视频和广告统计请求，DOMContentLoaded 后即返回(eager)，
+                     用等待价格和优惠券节点代替固定的 sleep，减少每个页面的耗时和代理流量
+        """
         if self._chrome is not None:
             return
-            
+
+        self.standalone = standalone
+        self.proxy = proxy
+        self.lean = lean
         chrome_options = Options()
         
         # 添加反检测参数
@@ -53,6 +133,11 @@ class Crawler(object):
         chrome_options.add_argument('--disable-features=IsolateOrigins,site-per-process')  # 禁用站点隔离
         chrome_options.add_argument('--ignore-certificate-errors')  # 忽略证书错误
         chrome_options.add_argument('--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.7049.95 Safari/537.36')
+
+        if lean:
+            chrome_options.page_load_strategy = 'eager'  # DOM 解析完成即返回，不等待图片等子资源
+            chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+            chrome_options.add_argument('--mute-audio')
         
         if proxy:
             proxy_address = proxy['https']
@@ -98,6 +183,9 @@ class Crawler(object):
             '''
         })
         
+        if lean:
+            self._block_urls(LEAN_BLOCKED_URLS)
+
         # 设置窗口大小为较小的尺寸，以减少资源占用
         self._chrome.set_window_size(1366, 768)
         # 设置较短的超时时间
@@ -105,8 +193,9 @@ class Crawler(object):
         self._chrome.set_script_timeout(20)
         self._chrome.implicitly_wait(5)
         
-        # 设置cookies文件
+        # 设置cookies文件，使用同一文件的 worker 共用登录状态和写入记录
         self.cookies_file = cookies_file or 'jd_pc_cookies.pkl'
+        self.session = CookieSession.get(self.cookies_file)
         
         # 如果没有跳过加载cookies，则尝试加载
         if not skip_cookies:
@@ -116,6 +205,54 @@ class Crawler(object):
     def chrome(self):
         return self._chrome
 
+    @property
+    def driver_pid(self):
+        """chromedriver 进程号，Chrome 进程是它的子进程，None 表示浏览器未启动"""
+        try:
+            return self._chrome.service.process.pid
+        except AttributeError:
+            return None
+
+    def _block_urls(self, patterns):
+        """通过 DevTools 拦截匹配的请求，请求不会发出，不消耗带宽"""
+        try:
+            self._chrome.execute_cdp_cmd('Network.enable', {})
+            self._chrome.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+        except Exception as e:
+            logging.warning('Block urls failure, fall back to full page load: %s', e)
+
+    def _wait_for(self, condition, timeout, fallback_sleep):
+        """
+        精简模式下等待 condition 成立（超时不报错），普通模式下保持原来的固定等待
+        :return: condition 是否成立
+        """
+        if not self.lean:
+            time.sleep(fallback_sleep)
+            return True
+        try:
+            WebDriverWait(self.chrome, timeout, poll_frequency=0.2).until(condition)
+            return True
+        except TimeoutException:
+            return False
+
+    @staticmethod
+    def _price_ready(driver):
+        # 价格节点由脚本异步填充，出现数字即可；跳转到登录页或首页时也停止等待
+        return driver.execute_script(PRICE_READY_JS, PRICE_SELECTOR)
+
+    @staticmethod
+    def _coupon_ready(driver):
+        # 用脚本检查，不走 find_element，每次轮询不会被隐式等待阻塞
+        return driver.execute_script(COUPON_READY_JS, COUPON_SELECTOR)
+
+    def _extract_page(self):
+        """
+        当前页面的快照，一次往返
+        :return: {url, title, need_login, prices: [text, ...], has_coupon_box, coupons: [{price, condition, expire}, ...]}
+        """
+        with timer('extraction'):
+            return self.chrome.execute_script(EXTRACT_PAGE_JS, PRICE_SELECTOR, COUPON_SELECTOR)
+
     def quit(self):
         """安全关闭浏览器"""
         if self._chrome is not None:
@@ -125,95 +262,94 @@ class Crawler(object):
                 print(f"关闭浏览器时发生错误: {e}")
             finally:
                 self._chrome = None
-                Crawler._instance = None
+                if not getattr(self, 'standalone', False):
+                    Crawler._instance = None
 
     def __del__(self):
         """析构函数，确保浏览器被关闭"""
         self.quit()
 
+    @timed('cookie_save')
     def save_cookies(self, cookies_file=None):
-        """保存 cookies 到文件"""
+        """
+        保存 cookies 到文件，只在 cookies 有变化时写入
+        :return: 文件中的 cookies 是否为最新
+        """
         try:
             cookies = self.chrome.get_cookies()
-            target_file = cookies_file or self.cookies_file
             if cookies:
-                with open(target_file, 'wb') as f:
-                    pickle.dump(cookies, f)
+                session = CookieSession.get(cookies_file) if cookies_file else self.session
+                session.save(cookies)
                 return True
         except Exception as e:
             print(f"保存 cookies 失败: {e}")
         return False
 
+    def add_cookies(self, cookies):
+        """
+        把 cookies 注入浏览器，通过 DevTools 设置，不需要先打开京东页面
+        :return: 注入的数量
+        """
+        now = time.time()
+        cookies = [cookie for cookie in cookies if not ('expiry' in cookie and cookie['expiry'] < now)]
+        params = []
+        for cookie in cookies:
+            param = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+                     if key in cookie}
+            if 'expiry' in cookie:
+                param['expires'] = cookie['expiry']
+            params.append(param)
+        try:
+            self.chrome.execute_cdp_cmd('Network.setCookies', {'cookies': params})
+            return len(params)
+        except Exception as e:
+            logging.info('Set cookies by DevTools failure, fall back to add_cookie: %s', e)
+        # add_cookie 只能设置当前域名的 cookies，需要先访问一下京东主页
+        self.chrome.get('https://www.jd.com')
+        added = 0
+        for cookie in cookies:
+            try:
+                self.chrome.add_cookie(cookie)
+                added += 1
+            except Exception as e:
+                print(f"添加单个cookie时出错: {e}")
+        return added
+
     def load_cookies(self, cookies_file=None):
-        """从文件加载 cookies"""
+        """从文件加载 cookies，登录状态在 session 有效期内已验证过时不再打开页面检查"""
+        session = CookieSession.get(cookies_file) if cookies_file else self.session
         try:
-            target_file = cookies_file or self.cookies_file
-            if os.path.exists(target_file):
-                with open(target_file, 'rb') as f:
-                    cookies = pickle.load(f)
-                    if cookies:
-                        # 先访问一下京东主页，这样才能添加 cookies
-                        self.chrome.get('https://www.jd.com')
-                        time.sleep(1)
-                        
-                        # 添加所有 cookies
-                        for cookie in cookies:
-                            try:
-                                # 确保 cookie 有效
-                                if 'expiry' in cookie and cookie['expiry'] < time.time():
-                                    continue
-                                self.chrome.add_cookie(cookie)
-                            except Exception as e:
-                                print(f"添加单个cookie时出错: {e}")
-                                continue
-                        
-                        # 刷新页面以应用 cookies
-                        self.chrome.refresh()
-                        time.sleep(1)
-                        
-                        # 验证登录状态
-                        if self.check_login_status():
-                            print(f"Cookies 从 {target_file} 加载成功，已成功登录")
-                            return True
-                        else:
-                            print(f"Cookies 从 {target_file} 加载失败，已失效")
-                            # 删除失效的 cookies 文件
-                            os.remove(target_file)
+            cookies = session.load()
+            if cookies:
+                self.add_cookies(cookies)
+                # 验证登录状态
+                if self.check_login_status(session=session):
+                    print(f"Cookies 从 {session.path} 加载成功，已成功登录")
+                    return True
+                else:
+                    print(f"Cookies 从 {session.path} 加载失败，已失效")
+                    # 删除失效的 cookies 文件
+                    session.remove()
         except Exception as e:
             print(f"加载 cookies 失败: {e}")
         return False
 
-    def check_login_status(self):
-        """检查是否已登录"""
+    def check_login_status(self, force=False, session=None):
+        """
+        检查是否已登录，同一 cookies 文件在 session 有效期内只打开一次京东主页检查
+        :param force: 忽略有效期，重新检查
+        """
+        session = session or self.session
+        if not force and session.login_valid:
+            return True
         try:
             self.chrome.get('https://www.jd.com')
-            time.sleep(1)
-            
             # 检查多个可能的未登录标识
-            not_logged_in_indicators = [
-                "请登录",
-                "登录注册",
-                "login-tab-r",
-                "登录京东"
-            ]
-            
-            page_source = self.chrome.page_source
-            for indicator in not_logged_in_indicators:
-                if indicator in page_source:
-                    return False
-                    
-            # 尝试检查登录后才会出现的元素
-            try:
-                # 等待可能出现的用户名元素
-                WebDriverWait(self.chrome, 3).until(
-                    EC.presence_of_element_located((By.CLASS_NAME, "nickname"))
-                )
-                return True
-            except:
-                pass
-                
+            if self.chrome.execute_script(NOT_LOGGED_IN_JS):
+                session.invalidate()
+                return False
+            session.mark_valid()
             return True
-            
         except Exception as e:
             print(f"检查登录状态失败: {e}")
             return False
@@ -227,7 +363,7 @@ class Crawler(object):
         input()
         
         # 检查登录状态
-        if self.check_login_status():
+        if self.check_login_status(force=True):
             print("登录成功！")
             self.save_cookies()
             return True
@@ -249,6 +385,7 @@ class Crawler(object):
         import re
         item_info_dict = {"title": None, "price": None, "has_coupon": None, "coupon_detail_list": None}
         original_url = None
+        result = 'failure'  # success, captcha, login or failure, counted in crawl_total
         # 彻底防止重复拼接
         if isinstance(item, str) and item.strip().startswith("http"):
             url = item.strip()
@@ -260,48 +397,52 @@ class Crawler(object):
                 raise ValueError(f"get_jd_item 参数异常，既不是url也不是纯数字ID: {item}")
             item_id_for_debug = item
             url = 'https://item.jd.com/' + str(item) + '.html'
+        # 登录状态超过有效期后由一个 worker 重新检查，其余 worker 照常抓取
+        if self.session.claim_recheck() and not self.check_login_status(force=True):
+            print("登录状态已失效，cookies 需要更新")
         try:
             original_url = url
-            self.chrome.get(url)
-            time.sleep(2)
+            with timer('page_load'):
+                self.chrome.get(url)
+                if not self._wait_for(self._price_ready, 10, 2):
+                    logging.info('Wait price node timeout: %s', item_id_for_debug)
+            page = self._extract_page()
             # 只保留页面标题的输出，移除URL显示
-            print(f"页面标题: {self.chrome.title}")
+            print(f"页面标题: {page['title']}")
             
             # 已去除保存页面源码到 debug.html 的调试代码
-            if "passport.jd.com" in self.chrome.current_url or "请登录" in self.chrome.page_source:
+            if "passport.jd.com" in page['url'] or page['need_login']:
                 print("检测到跳转到登录页，未登录或cookies失效")
+                result = 'login'
+                self.session.invalidate()
                 raise Exception("未登录或cookies失效")
-            if "www.jd.com" in self.chrome.current_url:
+            if "www.jd.com" in page['url']:
                 print("检测到跳转到京东首页，可能未通过反爬")
+                result = 'captcha'
                 raise Exception("被重定向到首页，反爬机制触发")
             
             # 在获取价格之前尝试点击"更多"按钮
             print("\n尝试点击'更多'按钮展开优惠信息...")
-            self._click_more_button()
+            if self._click_more_button():
+                page = self._extract_page()  # 弹出层展开后重新取一次快照
             print("点击操作完成，继续获取价格")
             
-            main_price_xpaths = [
-                "//span[contains(@class,'p-price')]/span[contains(@class,'price')]"
-            ]
             main_price = None
-            for xpath in main_price_xpaths:
-                price_eles = self.chrome.find_elements(By.XPATH, xpath)
-                if price_eles:
-                    for ele in price_eles:
-                        text = ele.text.strip().replace("￥", "").replace(",", "")
-                        if text and text.replace('.', '', 1).isdigit():
-                            main_price = text
-                            print(f"主售价节点 (xpath: {xpath})，内容: {ele.text}")
-                            break
-                if main_price:
+            for text in page['prices']:
+                price = text.replace("￥", "").replace(",", "")
+                if price and price.replace('.', '', 1).isdigit():
+                    main_price = price
+                    print(f"主售价节点 (css: {PRICE_SELECTOR})，内容: {text}")
                     break
 
-            item_info_dict = {'title': self.chrome.title, 'price': main_price}
+            item_info_dict = {'title': page['title'], 'price': main_price}
+            if main_price:
+                result = 'success'
             
             # 价格找到后，再次检查是否有优惠券（以防点击"更多"按钮后有变化）
             print("\n--- 检查优惠券状态 ---")
             try:
-                item_info_dict['has_coupon'], coupon_detail_list = self.check_has_coupon()
+                item_info_dict['has_coupon'], coupon_detail_list = self.check_has_coupon(page)
                 item_info_dict['coupon_detail_list'] = coupon_detail_list
                 if item_info_dict['has_coupon']:
                     print(f"优惠券详细信息：{coupon_detail_list}")
@@ -311,50 +452,43 @@ class Crawler(object):
             logging.warning('Crawl failure: {}'.format(e))
             print(f"发生错误: {str(e)}")
         finally:
-            if any(value is not None for value in item_info_dict.values()):
-                self.save_cookies()
+            inc('crawl_total', result=result)
+            if result == 'success':
+                self.save_cookies()  # cookies 没有变化时不写文件
             logging.info('Crawl finished')
         return item_info_dict
 
             
+    @timed('click_more')
     def _click_more_button(self):
-        """尝试点击页面上的'更多'按钮，弹出右侧界面"""
+        """
+        尝试点击页面上的'更多'按钮，弹出右侧界面
+        :return: 是否点击了按钮
+        """
         try:
-            # 使用精确的CSS选择器查找more-btn元素
-            more_btn = self.chrome.find_element(By.CSS_SELECTOR, "span.more-btn")
-            
-            # 如果找到了元素并且可见，使用JavaScript点击它
-            if more_btn.is_displayed():
-                self.chrome.execute_script("arguments[0].click();", more_btn)
-                time.sleep(1)  # 等待弹出层显示
+            # 查找、判断可见和点击在同一次脚本调用中完成
+            if self.chrome.execute_script(CLICK_MORE_JS):
+                # 等待弹出层中的优惠券列表显示，没有优惠券的商品等到超时
+                self._wait_for(self._coupon_ready, 2, 1)
+                return True
         except Exception as e:
             logging.debug(f"点击'更多'按钮失败: {e}")
+        return False
             
-    def check_has_coupon(self):
-        """仅根据新版京东优惠券区域判断并提取所有优惠券信息"""
+    @timed('coupon_parse')
+    def check_has_coupon(self, page=None):
+        """
+        仅根据新版京东优惠券区域判断并提取所有优惠券信息
+        :param page: _extract_page 的快照，None 时重新获取
+        """
         try:
-            coupon_detail_list = []
-            coupons_box = self.chrome.find_elements(By.CSS_SELECTOR, "div.coupons-list-box")
-            if coupons_box:
-                coupon_quans = coupons_box[0].find_elements(By.CSS_SELECTOR, ".coupon-quan")
-                for cq in coupon_quans:
-                    try:
-                        price = cq.find_element(By.CSS_SELECTOR, ".coupon-quan-left-price").text.strip()
-                    except Exception:
-                        price = ""
-                    try:
-                        condition = cq.find_element(By.CSS_SELECTOR, ".coupon-quan-right-price").text.strip()
-                    except Exception:
-                        condition = ""
-                    try:
-                        expire = cq.find_element(By.CSS_SELECTOR, ".coupon-quan-right-font").text.strip()
-                    except Exception:
-                        expire = ""
-                    coupon_detail_list.append({
-                        "面值": price,
-                        "门槛": condition,
-                        "有效期": expire
-                    })
+            page = page or self._extract_page()
+            if page['has_coupon_box']:
+                coupon_detail_list = [{
+                    "面值": coupon['price'],
+                    "门槛": coupon['condition'],
+                    "有效期": coupon['expire']
+                } for coupon in page['coupons']]
                 print("【检测到优惠券】此商品有优惠券可用！！！")
                 return True, coupon_detail_list
             else:
@@ -382,6 +516,108 @@ class Crawler(object):
         return huihui_info_dict
 
 
+class CrawlerPool(object):
+    """
+    固定大小的浏览器池：worker 按需创建，借出(acquire)/归还(release)，
+    每个 worker 是独立的 Chrome 实例，拥有自己的 cookies 和代理
+    """
+
+    def __init__(self, size, proxy_factory=None, skip_cookies=False, cookies_file=None, setup=None, lean=False):
+        """
+        :param size: 最多同时存在的浏览器数量
+        :param proxy_factory: 创建 worker 时调用，返回该 worker 使用的代理 {"http": ..., "https": ...}，None 表示本地 IP
+        :param setup: 创建 worker 后调用 setup(worker)，返回 False 表示该 worker 不可用
+        :param lean: worker 使用精简页面加载模式，见 Crawler
+        """
+        self.size = max(1, int(size))
+        self.proxy_factory = proxy_factory
+        self.skip_cookies = skip_cookies
+        self.cookies_file = cookies_file
+        self.setup = setup
+        self.lean = lean
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._creating = 0  # 正在创建中的 worker 数
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create_worker(self):
+        proxy = self.proxy_factory() if self.proxy_factory else None
+        worker = Crawler(proxy, skip_cookies=self.skip_cookies, cookies_file=self.cookies_file, standalone=True,
+                         lean=self.lean)
+        if self.setup and not self.setup(worker):
+            worker.quit()
+            raise RuntimeError('Crawler worker setup failure')
+        logging.info('Crawler pool created worker, proxy: %s', proxy)
+        return worker
+
+    @timed('browser_acquire')
+    def acquire(self, timeout=None):
+        """借出一个空闲 worker；池未满时新建，已满时阻塞等待归还"""
+        if self._closed:
+            raise RuntimeError('Crawler pool is closed')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = len(self._workers) + self._creating < self.size
+            if can_create:
+                self._creating += 1  # 先占位，避免并发创建超过 size
+        if not can_create:
+            return self._idle.get(timeout=timeout)
+        try:
+            worker = self._create_worker()
+            with self._lock:
+                self._workers.add(worker)
+        finally:
+            with self._lock:
+                self._creating -= 1
+        return worker
+
+    def release(self, worker, discard=False):
+        """归还 worker；discard=True 时关闭该浏览器（例如代理失效），下次借出时重新创建"""
+        if discard or self._closed:
+            with self._lock:
+                self._workers.discard(worker)
+            worker.quit()
+            return
+        self._idle.put(worker)
+
+    @contextmanager
+    def worker(self, timeout=None):
+        """with pool.worker() as cr: ...，出现异常时丢弃该 worker"""
+        worker = self.acquire(timeout)
+        try:
+            yield worker
+        except Exception:
+            self.release(worker, discard=True)
+            raise
+        self.release(worker)
+
+    def imap_unordered(self, func, items):
+        """以池大小为并发度执行 func(item)，按完成顺序产出 (item, future)"""
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            for future in as_completed(futures):
+                yield futures[future], future
+
+    def pids(self):
+        """所有 worker 的 chromedriver 进程号"""
+        with self._lock:
+            workers = list(self._workers)
+        return [pid for pid in (worker.driver_pid for worker in workers) if pid]
+
+    def close(self):
+        """关闭池中所有浏览器"""
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.quit()
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     start = time.time()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import logging
+from crawler_js import NAME_FAILURE
+from crawler_async import crawl_items_info
+from proxy import Proxy
+from metrics import inc, timer
+
+
+class TierStats(object):
+    """单个抓取层的计数：crawl 抓取次数，hit 成功次数，fallback 交给下一层（最后一层即失败）的次数"""
+
+    def __init__(self, name):
+        self.name = name
+        self.crawl = 0
+        self.hit = 0
+        self.fallback = 0
+
+    def hit_rate(self):
+        return self.hit / self.crawl if self.crawl else 0.0
+
+    def fallback_rate(self):
+        return self.fallback / self.crawl if self.crawl else 0.0
+
+    def __repr__(self):
+        return '%s: crawl %s, hit %s (%.1f%%), fallback %s (%.1f%%)' % (
+            self.name, self.crawl, self.hit, self.hit_rate() * 100, self.fallback, self.fallback_rate() * 100)
+
+
+class TieredFetcher(object):
+    """
+    分层抓取：先用廉价的 HTTP 接口(crawler_async)批量抓取名称、价格和历史价格，
+    抓取失败或遇到验证码时，再交给浏览器抓取
+    """
+
+    def __init__(self, browser_fetch, browser_map, proxy_factory=None, http_first=True):
+        """
+        :param browser_fetch: browser_fetch(item_id) 用浏览器抓取单个商品，返回 item_info
+        :param browser_map: browser_map(func, item_ids) 并发执行 func，按完成顺序产出 (item_id, future)，如 CrawlerPool.imap_unordered
+        :param proxy_factory: 返回 HTTP 层使用的代理，None 表示本地 IP
+        :param http_first: False 时跳过 HTTP 层，全部使用浏览器
+        """
+        self.browser_fetch = browser_fetch
+        self.browser_map = browser_map
+        self.proxy_factory = proxy_factory
+        self.http_first = http_first
+        self.http_stats = TierStats('http')
+        self.browser_stats = TierStats('browser')
+
+    @staticmethod
+    def _http_hit(item_info):
+        # False: crawl failure, None/'-1': missing in the mgets response or rejected id, the browser may still find it
+        return item_info is not None and item_info['price'] not in (False, None, '-1') and \
+            item_info['title'] and item_info['title'] != NAME_FAILURE
+
+    def _fetch_http(self, item_ids):
+        """
+        :return: 成功的 {item_id: item_info}, 需要交给浏览器的 [item_id, ...]
+        """
+        proxy = self.proxy_factory() if self.proxy_factory else None
+        try:
+            with timer('http_tier'):
+                items_info = crawl_items_info(item_ids, Proxy.get_ua(), proxy)
+        except Exception as e:  # the whole batch goes to the browser
+            logging.warning('HTTP tier failure: %s', e)
+            items_info = {}
+        hits, fallbacks = {}, []
+        for item_id in item_ids:
+            self.http_stats.crawl += 1
+            item_info = items_info.get(item_id)
+            if not self._http_hit(item_info):
+                self.http_stats.fallback += 1
+                inc('fetch_total', tier='http', result='fallback')
+                fallbacks.append(item_id)
+                continue
+            self.http_stats.hit += 1
+            inc('fetch_total', tier='http', result='hit')
+            hits[item_id] = item_info
+        return hits, fallbacks
+
+    def fetch(self, item_ids):
+        """
+        抓取商品信息，HTTP 层的结果先返回，浏览器层的结果按完成顺序返回
+        :return: 生成 (item_id, item_info)，item_info: {title, price, max_price, min_price[, has_coupon, coupon_detail_list]}
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        browser_ids = item_ids
+        if self.http_first and item_ids:
+            hits, browser_ids = self._fetch_http(item_ids)
+            for item_id, item_info in hits.items():
+                yield item_id, item_info
+        for item_id, future in self.browser_map(self.browser_fetch, browser_ids):
+            self.browser_stats.crawl += 1
+            try:
+                item_info = future.result()
+            except Exception as e:
+                logging.warning('Crawl item %s failure: %s', item_id, e)
+                self.browser_stats.fallback += 1
+                inc('fetch_total', tier='browser', result='fallback')
+                continue
+            if item_info['price']:
+                self.browser_stats.hit += 1
+                inc('fetch_total', tier='browser', result='hit')
+            else:
+                self.browser_stats.fallback += 1
+                inc('fetch_total', tier='browser', result='fallback')
+            yield item_id, item_info
+
+    def report(self):
+        logging.warning('Fetch tiers: %s; %s', self.http_stats, self.browser_stats)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import logging
+import os
+import socket
+import time
+import uuid
+from conn_sql import Sql
+
+
+class LeaseQueue(object):
+    """
+    Leases of work shared by monitor nodes through the lease table of the shared database
+    A node crawls an item or sends an alert only after claiming its lease, so no work is done twice.
+    Leases expire after ttl unless renewed, the work of a crashed node is reclaimed by others after that
+    """
+
+    def __init__(self, ttl, owner=None):
+        """
+        :param ttl: visibility timeout in seconds, leases are renewed every ttl / 3 while held
+        :param owner: id of this node, default hostname-pid-random
+        """
+        self.ttl = ttl
+        self.owner = owner or '%s-%s-%s' % (socket.gethostname()[:40], os.getpid(), uuid.uuid4().hex[:8])
+        self.held = set()  # lease names held by this node
+        self._last_renew = time.time()
+
+    @staticmethod
+    def _name(kind, key):
+        return '%s:%s' % (kind, key)
+
+    def claim(self, kind, keys):
+        """
+        :param kind: 'item' or 'mail'
+        :return: [key, ...] held by this node now, leases already held are kept
+        """
+        names = {self._name(kind, key): key for key in keys}
+        new_names = [name for name in names if name not in self.held]
+        if new_names:
+            claimed = Sql().claim_leases(new_names, self.owner, self.ttl)
+            reclaimed = [name for name, owner in claimed.items() if owner and owner != self.owner]
+            if reclaimed:
+                logging.warning('Reclaimed %s expired leases: %s', len(reclaimed), reclaimed[:10])
+            self.held.update(claimed)
+        return [key for name, key in names.items() if name in self.held]
+
+    def renew(self, force=False):
+        """Extend all held leases, at most once every ttl / 3 unless force"""
+        if not self.held or (not force and time.time() - self._last_renew < self.ttl / 3):
+            return
+        self._last_renew = time.time()
+        held = Sql().renew_leases(self.held, self.owner, self.ttl)
+        lost = self.held - held
+        if lost:
+            # renewed too late and taken by another node, its result may be written twice
+            logging.critical('Lost %s leases: %s', len(lost), list(lost)[:10])
+        self.held = held
+
+    def release(self, kind, keys_free_ts):
+        """
+        :param keys_free_ts: {key: free_ts}, other nodes can claim the lease from free_ts, 0 for at once
+        """
+        leases = {self._name(kind, key): free_ts for key, free_ts in keys_free_ts.items()}
+        leases = {name: free_ts for name, free_ts in leases.items() if name in self.held}
+        if leases:
+            Sql().release_leases(leases, self.owner)
+            self.held.difference_update(leases)
+
+    def free_ts(self, kind, keys):
+        """:return: {key: unix timestamp from which the lease can be claimed}"""
+        names = {self._name(kind, key): key for key in keys}
+        return {names[name]: ts for name, ts in Sql().read_leases_free_ts(names).items()}
+
+    def release_all(self):
+        if self.held:
+            Sql().release_leases({name: 0 for name in self.held}, self.owner)
+            self.held.clear()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import random
+import threading
+
+
+class LocalRedis(object):
+    """
+    In-process stand-in of the redis set commands used by the proxy pool, for tests and running without redis
+    Members are returned as bytes like redis-py
+    """
+
+    def __init__(self, sets=None):
+        self._sets = {}
+        self._lock = threading.Lock()
+        for key, members in (sets or {}).items():
+            self.sadd(key, *members)
+
+    @staticmethod
+    def _encode(value):
+        return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    def sadd(self, key, *values):
+        with self._lock:
+            members = self._sets.setdefault(key, set())
+            before = len(members)
+            members.update(self._encode(value) for value in values)
+            return len(members) - before
+
+    def srem(self, key, *values):
+        with self._lock:
+            members = self._sets.get(key, set())
+            before = len(members)
+            members.difference_update(self._encode(value) for value in values)
+            return before - len(members)
+
+    def scard(self, key):
+        return len(self._sets.get(key, ()))
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._sets.get(key, ()))
+
+    def srandmember(self, key, number=None):
+        with self._lock:
+            members = list(self._sets.get(key, ()))
+        if number is None:
+            return random.choice(members) if members else None
+        return random.sample(members, min(number, len(members)))
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline(object):
+    # queue commands and run them on execute, like redis-py pipeline
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._commands = []
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
@@ -7,6 +7,10 @@ import smtplib
 from os import path
 import os
 import logging
+import queue
+import threading
+import time
+from metrics import inc, timer
 
 
 class Mail(object):
@@ -36,15 +40,131 @@ class Mail(object):
         name, addr = parseaddr(s)
         return formataddr((Header(name, 'utf-8').encode(), addr))
 
-    def send(self):
+    @classmethod
+    def connect(cls, smtp_server=None, port=465, use_ssl=True, login=True):
         # server = smtplib.SMTP(self.smtp_server, 25)  # 25 normal，465 SSL
-        server = smtplib.SMTP_SSL(self.smtp_server, 465)
+        if use_ssl:
+            server = smtplib.SMTP_SSL(smtp_server or cls.smtp_server, port)
+        else:
+            server = smtplib.SMTP(smtp_server or cls.smtp_server, port)
         # server.starttls()  # SSL required
         server.set_debuglevel(1)
-        server.login(self.from_addr, self.password)
+        if login:
+            server.login(cls.from_addr, cls.password)
+        return server
+
+    def send(self, server=None):
+        """
+        :param server: connected smtp server to reuse, a new connection is opened and closed if None
+        """
+        own_server = server is None
+        if own_server:
+            server = self.connect()
         server.sendmail(self.from_addr, [self.to_addr], self.msg.as_string())
         logging.info('----This email\'s info: %s, %s, %s', self.text, self.receiver, self.to_addr)
-        server.quit()
+        if own_server:
+            server.quit()
+
+
+class MailDispatcher(object):
+    """
+    Send mails from a background queue over one persistent authenticated SMTP connection,
+    reconnect when the connection is broken, at most one mail every interval seconds
+    Results are collected by done() in the caller's thread
+    """
+
+    def __init__(self, interval=0, smtp_server=None, port=465, use_ssl=True, login=True, max_retries=2):
+        self.interval = interval
+        self.smtp_server = smtp_server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.login = login
+        self.max_retries = max_retries
+        self._server = None
+        self._queue = queue.Queue()
+        self._done = queue.Queue()
+        self._thread = None
+        self._last_send = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._send_loop, name='mail-dispatcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Send the mails already queued, then close the connection"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, mail, key=None):
+        """
+        :param key: returned with the result by done(), e.g. column_id of the alert
+        """
+        self._queue.put((mail, key))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def done(self):
+        """
+        :return: [(key, success), ...] of mails finished since last call
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._done.get_nowait())
+            except queue.Empty:
+                return results
+
+    def _close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def _send(self, mail):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self._server is None:
+                    self._server = Mail.connect(self.smtp_server, self.port, self.use_ssl, self.login)
+                mail.send(self._server)
+                return True
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+                logging.warning('SMTP connection broken, reconnecting: %s', e)
+                self._close()
+            except smtplib.SMTPException as e:  # refused by server, retry will not help
+                logging.critical('Sent email failure: %s, %s', mail.to_addr, e)
+                self._close()
+                return False
+            except OSError as e:  # socket error, SMTPException is also OSError so it is caught above
+                logging.warning('SMTP connection broken, reconnecting: %s', e)
+                self._close()
+            except Exception:  # e.g. a malformed message or address, must not end the sender thread
+                logging.exception('Sent email failure: %s', mail.to_addr)
+                self._close()
+                return False
+        return False
+
+    def _send_loop(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._close()
+                return
+            mail, key = task
+            wait = self._last_send + self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            with timer('email_send'):
+                success = self._send(mail)
+            inc('email_total', result='success' if success else 'failure')
+            self._last_send = time.time()
+            self._done.put((key, success))
 
 
 if __name__ == '__main__':
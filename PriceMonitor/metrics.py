@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# seconds, from a DB commit to a full page load over a slow proxy
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = 'pricemonitor_'
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry(object):
+    """
+    In-process counters, gauges and histograms, every metric name has any number of label sets
+    Rendered in the Prometheus text format, and summarised per round in the log
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels): value
+        self._gauges = {}
+        self._histograms = {}  # (name, labels): Histogram
+        self._help = {}
+        self._last_round = ({}, {})  # counters and histogram (count, sum) at last round_summary
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """with REGISTRY.timer('page_load'): ..., observed into stage_seconds{stage="page_load"}"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def timed(self, stage):
+        """Decorator version of timer"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _labels_text(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                              for k, v in labels) + '}'
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h.buckets), list(h.counts), h.count, h.sum)
+                          for key, h in self._histograms.items()}
+        lines = []
+        for metrics, kind in ((counters, 'counter'), (gauges, 'gauge'), (histograms, 'histogram')):
+            for name in sorted({name for name, _ in metrics}):
+                full_name = PREFIX + name
+                if name in self._help:
+                    lines.append('# HELP %s %s' % (full_name, self._help[name]))
+                lines.append('# TYPE %s %s' % (full_name, kind))
+                for (metric_name, labels), value in sorted(metrics.items()):
+                    if metric_name != name:
+                        continue
+                    if kind != 'histogram':
+                        lines.append('%s%s %s' % (full_name, self._labels_text(labels), value))
+                        continue
+                    buckets, counts, count, total = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets + ['+Inf'], counts):
+                        cumulative += bucket_count
+                        lines.append('%s_bucket%s %s' % (full_name, self._labels_text(labels, (('le', bound),)),
+                                                         cumulative))
+                    lines.append('%s_sum%s %s' % (full_name, self._labels_text(labels), total))
+                    lines.append('%s_count%s %s' % (full_name, self._labels_text(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def round_summary(self):
+        """
+        Counters and stage timings since the last call, one line per metric
+        e.g. 'stage_seconds page_load: 50 x 1.203s avg, 60.1s total', 'crawl_total{result=success}: 48'
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.count, h.sum) for key, h in self._histograms.items()}
+            last_counters, last_histograms = self._last_round
+            self._last_round = (counters, histograms)
+        lines = []
+        for (name, labels), (count, total) in sorted(histograms.items()):
+            last_count, last_total = last_histograms.get((name, labels), (0, 0.0))
+            count, total = count - last_count, total - last_total
+            if count:
+                label = ','.join(str(v) for _, v in labels)
+                name_label = name + ' ' + label if label else name
+                lines.append('%s: %s x %.3fs avg, %.1fs total' % (name_label, count, total / count, total))
+        for (name, labels), value in sorted(counters.items()):
+            value -= last_counters.get((name, labels), 0)
+            if value:
+                label = ','.join('%s=%s' % (k, v) for k, v in labels)
+                lines.append('%s{%s}: %s' % (name, label, value))
+        return lines
+
+    def log_round_summary(self, title='Round metrics'):
+        lines = self.round_summary()
+        if lines:
+            logging.warning('%s:\n  %s', title, '\n  '.join(lines))
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """GET /metrics of a registry, served from a daemon thread"""
+    daemon_threads = True
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        super().__init__((host, port), MetricsHandler)
+        self.registry = registry
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='metrics-server', daemon=True).start()
+        logging.warning('Metrics endpoint: http://%s:%s/metrics', *self.server_address)
+        return self
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug('Metrics: ' + format, *args)
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+REGISTRY = Registry()
+REGISTRY.describe('stage_seconds', 'Time spent in each stage of crawling, storing and alerting')
+REGISTRY.describe('crawl_total', 'Item page crawls by result: success, captcha, login, failure')
+REGISTRY.describe('fetch_total', 'Items fetched by tier and result: hit, fallback')
+REGISTRY.describe('email_total', 'Emails sent by result')
+REGISTRY.describe('loop_lag_seconds', 'Delay between the due time of an item and its crawl start')
+REGISTRY.describe('scheduled_items', 'Items in the crawl schedule')
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serve REGISTRY on http://host:port/metrics, port 0 disables"""
+    if not port:
+        return None
+    try:
+        return MetricsServer(REGISTRY, port, host).start()
+    except OSError as e:
+        logging.warning('Metrics endpoint failure: %s', e)
+        return None
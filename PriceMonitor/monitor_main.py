@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 # coding=utf-8
-from proxy import Proxy
-from crawler_selenium import Crawler
+from proxy import Proxy, ProxyManager
+from crawler_selenium import CrawlerPool
+from fetcher import TieredFetcher
+from scheduler import Scheduler
+from lease import LeaseQueue
 from conn_sql import Sql
-from mail import Mail
-from CONFIG import ITEM_CRAWL_TIME, Email_TIME, PROXY_CRAWL
+from mail import Mail, MailDispatcher
+from metrics import REGISTRY, timer, start_http_server
+from profiler import RoundProfiler
+from CONFIG import ITEM_CRAWL_TIME, UPDATE_TIME, Email_TIME, PROXY_CRAWL, CRAWLER_POOL_SIZE, CRAWLER_LEAN, \
+    HTTP_CRAWL_FIRST, DB_BATCH_SIZE, SCHEDULE_MIN_INTERVAL, SCHEDULE_MAX_INTERVAL, SCHEDULE_BATCH_SIZE, \
+    EMAIL_DIGEST_TIME, WORK_LEASE, LEASE_TTL, METRICS_PORT, PROFILE_ROUNDS, PROXY_RETRIES
 import logging
 import logging.config
 import time
@@ -12,113 +19,257 @@ from os import path
 
 
 class Entrance(object):
-    proxy_info_zhima = ()
 
-    @staticmethod
-    def _check_item():
+    def __init__(self):
+        self.mail_dispatcher = MailDispatcher(Email_TIME).start()
+        self.email_pending = set()  # column_id of alerts queued but not sent yet
+        self.email_digest = {}  # email: {column_id: item_alert} waiting for the digest window
+        self.email_digest_start = 0
+        self.proxy_manager = self._create_proxy_manager()
+        self.pool = CrawlerPool(CRAWLER_POOL_SIZE, proxy_factory=self._get_proxy, lean=CRAWLER_LEAN)
+        self.scheduler = Scheduler(UPDATE_TIME, SCHEDULE_MIN_INTERVAL, SCHEDULE_MAX_INTERVAL)
+        self.fetcher = TieredFetcher(self._crawl_item, self.pool.imap_unordered,
+                                     proxy_factory=self._get_proxy, http_first=HTTP_CRAWL_FIRST)
+        self.leases = LeaseQueue(LEASE_TTL) if WORK_LEASE else None  # None: this node owns all items
+        self.metrics_server = start_http_server(METRICS_PORT)
+        self.profiler = RoundProfiler(PROFILE_ROUNDS, pids_source=self.pool.pids)
+
+    def _sync_schedule(self):
         """
-        检查本轮需要爬取的商品
-        :return: [{column_id, item_id}, ...]
+        从数据库同步仍在监控的商品到调度队列，到期时间为 update_time + UPDATE_TIME
         """
         sq = Sql()
-        items = sq.read_all_not_updated_item()
-        logging.warning('This loop ready to crawl: %s', items)
-        return items
+        items = sq.read_active_items()
+        keys_due = {}
+        for item_id, (update_time, user_price) in items.items():
+            due_ts = time.mktime(update_time.timetuple()) + UPDATE_TIME if update_time else None
+            keys_due[str(item_id)] = (due_ts, user_price)
+        self.scheduler.sync(keys_due)
+        logging.warning('Scheduler synced: %s items', len(self.scheduler))
 
-    def _item_info_update(self, item):
-        column_id = item['column_id']
-        item_id = str(item['item_id'])
-        sq = Sql()
+    def _claim_items(self, item_ids):
+        """
+        多节点模式下只抓取本节点拿到租约的商品，其他节点正在抓取或刚抓取过的商品推迟到租约释放后再尝试
+        :return: 本节点负责抓取的 [item_id, ...]
+        """
+        if self.leases is None:
+            return item_ids
+        claimed = self.leases.claim('item', item_ids)
+        others = set(item_ids) - set(claimed)
+        if others:
+            free_ts = self.leases.free_ts('item', others)
+            min_due = time.time() + SCHEDULE_MIN_INTERVAL
+            for item_id in others:
+                self.scheduler.defer(item_id, max(free_ts.get(item_id, 0), min_due))
+            logging.warning('Items leased by other nodes: %s', len(others))
+        return claimed
+
+    def _release_items(self, item_ids):
+        # lease is free again at the next due time, so other nodes do not crawl the item before it
+        if self.leases is not None:
+            self.leases.release('item', {item_id: self.scheduler.due_at(item_id) or 0 for item_id in item_ids})
+
+    @staticmethod
+    def _create_proxy_manager():
+        if not PROXY_CRAWL:
+            return None
         pr = Proxy()
         if PROXY_CRAWL == 1:
-            # Using free proxy pool
-            while True:
-                # tuple: header, proxy. Header for Js crawler
-                proxy_info = pr.get_proxy()
-                cr = Crawler(proxy_info[1])
-                item_info = cr.get_jd_item(item_id)
-                if item_info:
-                    sq.update_item_name(column_id, item_info['name'])
-                    sq.update_item_price(column_id, item_info['price'])
-                    # sq.update_item_plus_price(column_id, item_info['plus_price'])  # 已移除plus_price字段
-                    cr = Crawler(proxy_info[1])
-                    huihui_info = cr.get_huihui_item(item_id)
-                    if huihui_info:
-                        sq.update_item_max_price(column_id, huihui_info[0])
-                        sq.update_item_min_price(column_id, huihui_info[1])
-                    break
-        elif PROXY_CRAWL == 2:
-            # Using zhima proxy
-            while True:
-                if not self.proxy_info_zhima:
-                    self.proxy_info_zhima = pr.get_proxy_zhima()
-                logging.info('Zhima proxy: %s', self.proxy_info_zhima[1])
-                # tuple: header, proxy. Header for Js crawler
-                cr = Crawler(self.proxy_info_zhima[1])
-                item_info = cr.get_jd_item(item_id)
-                if not item_info:
-                    self.proxy_info_zhima = ()
-                    logging.warning('Zhima proxy crawl failure, changing proxy...')
-                    time.sleep(5)
-                    continue
-                else:
-                    sq.update_item_name(column_id, item_info['name'])
-                    sq.update_item_price(column_id, item_info['price'])
-                    # sq.update_item_plus_price(column_id, item_info['plus_price'])  # 已移除plus_price字段
-                    cr = Crawler(self.proxy_info_zhima[1])
-                    huihui_info = cr.get_huihui_item(item_id)
-                    if huihui_info:
-                        sq.update_item_max_price(column_id, huihui_info['max_price'])
-                        sq.update_item_min_price(column_id, huihui_info['min_price'])
-                    break
-        else:
-            # Using local ip
-            cr = Crawler()
-            # item_info: {name, price, plus_price, subtitle}
-            item_info = cr.get_jd_item(item_id)
-            sq.update_item_name(column_id, item_info['name'])
-            sq.update_item_price(column_id, item_info['price'])
-            # sq.update_item_plus_price(column_id, item_info['plus_price'])  # 已移除plus_price字段
-
-            cr = Crawler()
-            # huihui_info = {max_price, min_price}
-            huihui_info = cr.get_huihui_item(item_id)
-            if huihui_info:
-                sq.update_item_max_price(column_id, huihui_info['max_price'])
-                sq.update_item_min_price(column_id, huihui_info['min_price'])
+            # Using free proxy pool, proxies are validated before use
+            return pr.redis_manager()
+        # Using zhima proxy
+        return ProxyManager(pr.get_proxies_zhima).start()
 
+    def _get_proxy(self):
+        """
+        为新建的浏览器 worker 获取代理
+        :return: {"http": ..., "https": ...}，本地 IP 时为 None
+        """
+        if self.proxy_manager is None:
+            return None
+        proxy = self.proxy_manager.get()
+        logging.info('Using proxy: %s', proxy)
+        return proxy
+
+    def _crawl_item(self, item_id):
+        """
+        从浏览器池借出一个 worker 抓取商品，代理模式下抓取失败会丢弃该 worker 并换代理重试，最多 PROXY_RETRIES 次
+        （下架商品、验证码或登录失效时换代理也无济于事）
+        :return: item_info: {title, price, has_coupon, coupon_detail_list, max_price, min_price}，失败时 price 为 None
+        """
+        retries = PROXY_RETRIES if PROXY_CRAWL else 0
+        with self.profiler.thread_scope():
+            for attempt in range(retries + 1):
+                cr = self.pool.acquire()
+                discard = True
+                try:
+                    start = time.time()
+                    item_info = cr.get_jd_item(item_id)
+                    if self.proxy_manager:
+                        self.proxy_manager.report(cr.proxy, bool(item_info['price']), time.time() - start)
+                    if not PROXY_CRAWL or item_info['price']:
+                        # huihui_info = {max_price, min_price}
+                        item_info.update(cr.get_huihui_item(item_id))
+                        discard = False
+                        return item_info
+                finally:
+                    # 先归还(丢弃)浏览器再等待，不在 sleep 期间占用 worker
+                    self.pool.release(cr, discard=discard)
+                if attempt < retries:
+                    logging.warning('Proxy crawl failure, changing proxy...')
+                    time.sleep(5)
+        logging.warning('Proxy crawl failure %s times, give up in this round: %s', retries + 1, item_id)
+        item_info.update({'max_price': None, 'min_price': None})
         return item_info
 
     @staticmethod
-    def _send_email():
+    def _flush_items_info(items_info, prices):
+        """
+        批量写入本轮抓取结果和价格历史
+        :param items_info: {column_id: {item_name, item_price, highest_price, lowest_price}}
+        :param prices: {item_id: price}
+        """
+        sq = Sql()
+        if items_info:
+            sq.update_items(items_info)
+            items_info.clear()
+        if prices:
+            sq.write_price_history(prices)
+            prices.clear()
+
+    @staticmethod
+    def _plan_round(items):
+        """
+        按商品编号分组本轮的监控行，每个商品只抓取一次，结果写回所有监控该商品的行
+        :param items: [{column_id, item_id}, ...]
+        :return: {item_id: [column_id, ...]}
+        """
+        column_ids = {}
+        for item in items:
+            column_ids.setdefault(str(item['item_id']), []).append(item['column_id'])
+        logging.warning('This round: %s monitors, %s distinct items to crawl', len(items), len(column_ids))
+        return column_ids
+
+    def _items_info_update(self, items):
+        """
+        分层抓取本轮商品，数据库写入统一在主线程批量完成（Sql 的 session 不是线程安全的）
+        :return: {item_id: price}，抓取失败的商品价格为 None
+        """
+        column_ids = self._plan_round(items)
+        items_info, prices, prices_crawled = {}, {}, {}
+        for item_id, item_info in self.fetcher.fetch(list(column_ids)):
+            prices_crawled[item_id] = item_info['price']
+            for column_id in column_ids[item_id]:
+                items_info[column_id] = {'item_name': item_info['title'], 'item_price': item_info['price'],
+                                         'highest_price': item_info['max_price'],
+                                         'lowest_price': item_info['min_price']}
+            if item_info['price']:
+                prices[item_id] = item_info['price']
+            logging.warning('Update item: %s', item_info)
+            if self.leases is not None:
+                self.leases.renew()  # long rounds must not lose the leases
+            if len(items_info) >= DB_BATCH_SIZE:
+                self._flush_items_info(items_info, prices)
+        self._flush_items_info(items_info, prices)
+        self.fetcher.report()
+        return prices_crawled
+
+    def _send_email(self, item_ids=None):
+        """
+        把需要提醒的商品按用户合并，每个发送窗口(EMAIL_DIGEST_TIME)每个用户只发一封汇总邮件，
+        邮件由后台线程发送，不阻塞抓取
+        :param item_ids: 只检查这些商品的所有监控行，None 时检查全部
+        """
+        self._collect_email_results()
         sq = Sql()
         # items_alert = {column_id, item_id, user_price, item_price, name, email}
-        items_alert = sq.check_item_need_to_remind()
-        logging.warning('This loop sent email: %s', items_alert)
-        for item_alert in items_alert:  # item: [email, item_name, item_price, user_price, item_id, column_id]
-            item_url = 'https://item.jd.com/' + str(item_alert['item_id']) + '.html'
-            email_text = ' 您监控的物品：' + item_alert['name'] + '，现在价格为：' + item_alert['item_price'] + \
-                         '，您设定的价格为：' + item_alert['user_price'] + '，赶紧购买吧！' + item_url
-            email_subject = '您监控的物品降价了！'
-            try:
-                send_email = Mail(email_text, '价格监控系统', '亲爱的用户', email_subject, item_alert['email'])
-                send_email.send()
-                time.sleep(Email_TIME)
-            except:
-                logging.critical('Sent email failure, skip in this loop: %s', item_alert['email'])
-                continue
-            sq.update_status(item_alert['column_id'])
-            logging.warning('Sent monitor email SUCCESS: %s', item_alert['email'])
+        items_alert = sq.check_item_need_to_remind(item_ids)
+        # queued in previous round and not sent yet
+        items_alert = [item_alert for item_alert in items_alert if item_alert['column_id'] not in self.email_pending]
+        if self.leases is not None:  # the node holding the lease of an alert is the only one to send it
+            claimed = set(self.leases.claim('mail', [item_alert['column_id'] for item_alert in items_alert]))
+            items_alert = [item_alert for item_alert in items_alert if item_alert['column_id'] in claimed]
+        for item_alert in items_alert:
+            if not self.email_digest:
+                self.email_digest_start = time.time()
+            self.email_digest.setdefault(item_alert['email'], {})[item_alert['column_id']] = item_alert
+        if self.email_digest and time.time() - self.email_digest_start >= EMAIL_DIGEST_TIME:
+            self._dispatch_email_digest()
+
+    def _dispatch_email_digest(self):
+        for email, items_alert in self.email_digest.items():
+            email_text = ' 您监控的物品降价了，赶紧购买吧！\n'
+            for item_alert in items_alert.values():
+                item_url = 'https://item.jd.com/' + str(item_alert['item_id']) + '.html'
+                email_text += '\n' + str(item_alert['name']) + '，现在价格为：' + str(item_alert['item_price']) + \
+                              '，您设定的价格为：' + str(item_alert['user_price']) + '，' + item_url
+            email_subject = '您监控的%s件物品降价了！' % len(items_alert)
+            send_email = Mail(email_text, '价格监控系统', '亲爱的用户', email_subject, email)
+            self.mail_dispatcher.put(send_email, tuple(items_alert))
+            self.email_pending.update(items_alert)
+            logging.warning('Queued monitor email: %s, %s items', email, len(items_alert))
+        self.email_digest = {}
+
+    def _collect_email_results(self):
+        """
+        在主线程处理后台发送完成的邮件：发送成功的监控行批量停止监控，失败的在下一轮重新入队
+        """
+        sent, failed = [], []
+        for column_ids, success in self.mail_dispatcher.done():
+            self.email_pending.difference_update(column_ids)
+            if success:
+                sent.extend(column_ids)
+            else:
+                failed.extend(column_ids)
+                logging.critical('Sent email failure, retry in next loop: %s', column_ids)
+        if sent:
+            Sql().update_status_items(sent)
+            logging.warning('Sent monitor email SUCCESS: %s', sent)
+        if self.leases is not None and (sent or failed):
+            # sent alerts stay leased a while longer, so nodes that read the alert before status update skip it
+            free_ts = time.time() + LEASE_TTL
+            leases = {column_id: free_ts for column_id in sent}
+            leases.update((column_id, 0) for column_id in failed)
+            self.leases.release('mail', leases)
 
     def run(self):
+        """
+        按调度队列持续抓取到期的商品，每 ITEM_CRAWL_TIME 从数据库同步一次商品列表
+        """
+        last_sync = 0
+        self.profiler.install_signal()  # kill -USR1 <pid> or create profile.ctl to profile the next rounds
         while True:
-            items = self._check_item()
-            for item in items:
-                item_info = self._item_info_update(item)
-                logging.warning('Update item: %s', item_info)
-            self._send_email()
-            logging.warning('Ready to sleep: %s', ITEM_CRAWL_TIME)
-            time.sleep(ITEM_CRAWL_TIME)
+            if time.time() - last_sync >= ITEM_CRAWL_TIME:
+                self._sync_schedule()
+                last_sync = time.time()
+            if self.leases is not None:
+                self.leases.renew()  # alerts waiting in the digest window
+            item_ids = self.scheduler.pop_due(SCHEDULE_BATCH_SIZE)
+            if not item_ids:
+                self._send_email([])  # flush digest window and collect sent emails while idle
+                next_due_in = self.scheduler.next_due_in()
+                sleep_time = min(ITEM_CRAWL_TIME - (time.time() - last_sync), max(EMAIL_DIGEST_TIME, 1))
+                if next_due_in is not None:
+                    sleep_time = min(sleep_time, next_due_in)
+                if self.leases is not None:
+                    sleep_time = min(sleep_time, LEASE_TTL / 3)
+                time.sleep(max(sleep_time, 0.1))
+                continue
+            item_ids = self._claim_items(item_ids)
+            if not item_ids:
+                continue
+            self.profiler.begin_round()
+            with timer('round'):
+                items = Sql().read_items_by_item_id(item_ids)
+                logging.warning('Ready to crawl: %s', items)
+                prices = self._items_info_update(items)
+                for item_id in item_ids:
+                    self.scheduler.reschedule(item_id, prices.get(item_id))
+                self._release_items(item_ids)
+                self.scheduler.report()
+                self._send_email(item_ids)
+            self.profiler.end_round()
+            REGISTRY.log_round_summary()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import requests
+
+
+class Outbox(object):
+    """
+    Disk-backed outbox of webhook notifications (json POST)
+    Notifications are stored in a local SQLite file first, so a slow or broken endpoint never blocks the caller
+    and nothing is lost when the endpoint or the process is down.
+    A background thread sends them in batches over one keep-alive session, failed ones are retried with
+    exponential backoff, a notification equal to one still pending is dropped
+    """
+
+    def __init__(self, path='notice_outbox.db', batch_size=20, timeout=5, backoff=5, max_backoff=60 * 30,
+                 max_attempts=20, interval=1):
+        """
+        :param backoff: first retry delay in seconds, doubled on every failure up to max_backoff
+        :param max_attempts: notification is dropped after this many failures
+        :param interval: sender poll interval when the outbox is empty
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                           'id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, payload TEXT NOT NULL, '
+                           'dedup_key TEXT NOT NULL UNIQUE, attempts INTEGER NOT NULL DEFAULT 0, '
+                           'next_ts REAL NOT NULL, created_ts REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_outbox_next_ts ON outbox (next_ts)')
+        self._conn.commit()
+        self._session = requests.Session()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._send_loop, name='outbox-sender', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=5):
+        """Stop the sender, notifications not sent yet stay on disk for the next start"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            self._conn.close()
+        self._session.close()
+
+    def put(self, url, payload, dedup_key=None):
+        """
+        :param dedup_key: notifications with the same key are sent once while pending, default hash of url and payload
+        :return: False if dropped as duplicate
+        """
+        payload = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        if dedup_key is None:
+            dedup_key = hashlib.sha1((url + payload).encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute('INSERT OR IGNORE INTO outbox (url, payload, dedup_key, next_ts, created_ts) '
+                                        'VALUES (?, ?, ?, ?, ?)', (url, payload, dedup_key, now, now))
+            self._conn.commit()
+        self._wakeup.set()
+        return cursor.rowcount == 1
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def _due_batch(self):
+        with self._lock:
+            return self._conn.execute('SELECT id, url, payload, attempts FROM outbox WHERE next_ts <= ? '
+                                      'ORDER BY next_ts LIMIT ?', (time.time(), self.batch_size)).fetchall()
+
+    def _post(self, url, payload):
+        try:
+            r = self._session.post(url, data=payload.encode('utf-8'), timeout=self.timeout,
+                                   headers={'Content-Type': 'application/json'})
+            logging.info('Outbox sent: %s, %s', url, r.status_code)
+            return r.status_code < 500 and r.status_code != 429  # other 4xx will not succeed on retry
+        except requests.exceptions.RequestException as e:
+            logging.warning('Outbox send failure: %s, %s', url, e)
+            return False
+
+    def flush(self):
+        """
+        Send one batch of due notifications
+        :return: number of notifications sent
+        """
+        batch = self._due_batch()
+        sent, failed, dropped = [], [], []
+        for row_id, url, payload, attempts in batch:
+            if self._post(url, payload):
+                sent.append((row_id,))
+            elif attempts + 1 >= self.max_attempts:
+                logging.critical('Outbox drop notification after %s attempts: %s, %s', attempts + 1, url, payload)
+                dropped.append((row_id,))
+            else:
+                delay = min(self.backoff * 2 ** attempts, self.max_backoff)
+                failed.append((time.time() + delay, row_id))
+        with self._lock:
+            self._conn.executemany('DELETE FROM outbox WHERE id = ?', sent + dropped)
+            self._conn.executemany('UPDATE outbox SET attempts = attempts + 1, next_ts = ? WHERE id = ?', failed)
+            self._conn.commit()
+        return len(sent)
+
+    def _send_loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.flush() or self._due_batch():
+                    continue
+            except sqlite3.Error as e:
+                logging.warning('Outbox error: %s', e)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
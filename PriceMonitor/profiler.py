@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def process_tree_rss(pids, descendants=True):
+    """
+    Resident memory of processes and all their descendants, from /proc (Linux)
+    :return: bytes, None if /proc is not available
+    """
+    if not pids or not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc') if descendants else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except OSError:  # exited
+            continue
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])  # comm may contain spaces
+        children.setdefault(ppid, []).append(int(entry))
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rss, stack, seen = 0, list(pids), set()
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open('/proc/%s/statm' % pid) as f:
+                rss += int(f.read().split()[1]) * page_size
+        except OSError:
+            continue
+        stack.extend(children.get(pid, ()))
+    return rss
+
+
+class RoundProfiler(object):
+    """
+    Profiling of a long running monitor loop switched on at runtime, without restart
+    Triggered by SIGUSR1 or by creating the control file (optionally containing the number of rounds),
+    then for the next N rounds:
+    - cProfile of the loop thread and of worker threads wrapped in thread_scope()
+    - tracemalloc snapshot diffed against the previous round
+    - RSS of this process and of the browser process trees
+    Reports are written to report_dir/<start time>/
+    """
+
+    def __init__(self, rounds=5, report_dir='profile_reports', control_file='profile.ctl', pids_source=None,
+                 frames=10, top=30):
+        """
+        :param rounds: rounds profiled for every trigger, unless given in the control file
+        :param pids_source: pids_source() returns root pids of browser processes, e.g. CrawlerPool.pids
+        :param frames: traceback depth stored by tracemalloc
+        :param top: lines in every report
+        """
+        self.rounds = rounds
+        self.report_dir = report_dir
+        self.control_file = control_file
+        self.pids_source = pids_source
+        self.frames = frames
+        self.top = top
+        self._requested = 0  # rounds requested by signal, picked up at next begin_round
+        self._remaining = 0
+        self._round = 0
+        self._out_dir = None
+        self._profile = None
+        self._stats = None
+        self._stats_lock = threading.Lock()
+        self._snapshot = None
+        self._own_tracemalloc = False
+
+    @property
+    def active(self):
+        return self._remaining > 0
+
+    def install_signal(self, signum=getattr(signal, 'SIGUSR1', None)):
+        """kill -USR1 <pid> profiles the next rounds, only possible from the main thread on POSIX"""
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, self._on_signal)
+        return True
+
+    def _on_signal(self, signum, frame):
+        self._requested = self.rounds
+
+    def request(self, rounds=None):
+        self._requested = rounds or self.rounds
+
+    def _check_trigger(self):
+        rounds, self._requested = self._requested, 0
+        if self.control_file and os.path.exists(self.control_file):
+            try:
+                with open(self.control_file) as f:
+                    content = f.read().strip()
+                os.remove(self.control_file)
+                rounds = int(content) if content else self.rounds
+            except (OSError, ValueError) as e:
+                logging.warning('Profile control file error: %s', e)
+                rounds = rounds or self.rounds
+        return rounds
+
+    def begin_round(self):
+        """Call at the start of every loop round"""
+        if not self.active:
+            rounds = self._check_trigger()
+            if not rounds:
+                return
+            self._start(rounds)
+        self._round += 1
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError as e:  # another profiler is active
+            logging.warning('cProfile not available: %s', e)
+            self._profile = None
+
+    def _start(self, rounds):
+        self._remaining = rounds
+        self._round = 0
+        self._out_dir = os.path.join(self.report_dir, time.strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(self._out_dir, exist_ok=True)
+        self._stats = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._own_tracemalloc = True
+        self._snapshot = self._take_snapshot()
+        with open(os.path.join(self._out_dir, 'rss.tsv'), 'w', encoding='utf-8') as f:
+            f.write('round\tts\tprocess_rss\tbrowser_rss\n')
+        logging.warning('Profiling next %s rounds, reports in %s', rounds, self._out_dir)
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    @contextmanager
+    def thread_scope(self):
+        """Profile the wrapped code of a worker thread into the current report while profiling is active"""
+        if not self.active:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Python 3.12+ allows only one active profiler per process
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._merge(profile)
+
+    def _merge(self, profile):
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def end_round(self):
+        """Call at the end of every loop round"""
+        if not self.active:
+            return
+        if self._profile is not None:
+            self._profile.disable()
+            self._merge(self._profile)
+            self._profile = None
+        self._write_memory()
+        self._remaining -= 1
+        if not self.active:
+            self._finish()
+
+    def _write_memory(self):
+        snapshot = self._take_snapshot()
+        diff = snapshot.compare_to(self._snapshot, 'lineno')
+        self._snapshot = snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        own_rss = process_tree_rss([os.getpid()], descendants=False)  # browsers are children of this process
+        browser_rss = None
+        if self.pids_source is not None:
+            try:
+                browser_rss = process_tree_rss(self.pids_source())
+            except Exception as e:
+                logging.warning('Browser pids error: %s', e)
+        path = os.path.join(self._out_dir, 'round_%03d_memory.txt' % self._round)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('traced %.1f MiB, peak %.1f MiB\n' % (current / 2 ** 20, peak / 2 ** 20))
+            f.write('top %s allocation changes since previous round:\n' % self.top)
+            for stat in diff[:self.top]:
+                f.write('%s\n' % stat)
+        with open(os.path.join(self._out_dir, 'rss.tsv'), 'a', encoding='utf-8') as f:
+            f.write('%s\t%s\t%s\t%s\n' % (self._round, int(time.time()), own_rss, browser_rss))
+
+    def _finish(self):
+        if self._stats is not None:
+            self._stats.dump_stats(os.path.join(self._out_dir, 'cpu.prof'))  # for snakeviz, pstats
+            text = io.StringIO()
+            self._stats.stream = text
+            self._stats.sort_stats('cumulative').print_stats(self.top)
+            self._stats.sort_stats('tottime').print_stats(self.top)
+            with open(os.path.join(self._out_dir, 'cpu.txt'), 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+        self._snapshot = None
+        self._stats = None
+        logging.warning('Profiling finished after %s rounds, reports in %s', self._round, self._out_dir)
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import asyncio
 import random
 import time
 import redis
 import logging
+import threading
 import requests
 from crawler_selenium import Crawler
+from crawler_async import AsyncCrawler
+from metrics import timed
 from CONFIG import PROXY_POOL_IP
 USER_AGENT_LIST = [
     "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/22.0.1207.1 Safari/537.1",
@@ -39,55 +43,99 @@ USER_AGENT_LIST = [
 
 
 class Proxy(object):
+    _redis_pool = None  # shared by all clients created by redis_client()
+    _manager = None  # ProxyManager of the redis pool, shared by get_proxy() and the monitor
+    _manager_lock = threading.Lock()
+
+    def __init__(self, client=None):
+        """
+        :param client: redis client of the proxy pool, e.g. local_redis.LocalRedis for tests, default redis_client()
+        """
+        self.client = client or self.redis_client()
+
+    @classmethod
+    def redis_client(cls):
+        if cls._redis_pool is None:
+            cls._redis_pool = redis.ConnectionPool(host=PROXY_POOL_IP, port=6379, db=0)
+        return redis.Redis(connection_pool=cls._redis_pool)
 
     @staticmethod
     def check_jd(proxy, header):
         logging.info('Validating name proxy: %s', proxy)
-        cr = Crawler(proxy)
-        item_name = cr.get_jd_item('5089253')  # Iphone X
-        if item_name:
+        # standalone browser, the shared crawler keeps its own proxy and cookies
+        cr = Crawler(proxy, skip_cookies=True, standalone=True)
+        try:
+            item_info = cr.get_jd_item('5089253')  # Iphone X
+        finally:
+            cr.quit()
+        if item_info['price']:
             return True
         return False
 
+    def redis_manager(self):
+        """The started ProxyManager validating proxies of the redis pool, one per process"""
+        with self._manager_lock:
+            if Proxy._manager is None:
+                Proxy._manager = ProxyManager(self.get_proxies_redis, ProxyValidator().validate).start()
+            return Proxy._manager
+
     def get_proxy(self):
-        r = redis.Redis(host=PROXY_POOL_IP, port=6379, db=0)
-        while True:
-            good_proxies = r.srandmember("good_proxies", 1)
-            if good_proxies:
-                good_proxies = good_proxies[0].decode("utf-8")  # byte to str
-                good_proxies = {"http": good_proxies, "https": good_proxies}
-                header = self.get_ua()
-                if not self.check_jd(good_proxies, header):
-                        logging.warning('Validate proxy failure, retrying')
-                        continue
-                logging.info('Validate SUCCESS，using proxy: %s', good_proxies)
-                return header, good_proxies
-            else:
-                logging.critical('No proxy now from remote server, retrying')
-                time.sleep(5)
+        good_proxies = self.redis_manager().get()
+        logging.info('Validate SUCCESS，using proxy: %s', good_proxies)
+        return self.get_ua(), good_proxies
 
     def get_proxy_zhima(self):
-        url = 'http://webapi.http.zhimacangku.com/getip?num=1&type=2&pro=0' \
-              '&city=0&yys=0&port=11&pack=8241&ts=0&ys=0&cs=0&lb=1&sb=0&pb=4&mr=1&regions='
         while True:
-            header = self.get_ua()
-            r = requests.get(url, headers=header, timeout=5)
-            logging.warning('Zhima Proxy: %s', r.json())
-            if not r.json()['data']:
-                logging.warning('No Zhima Proxy anymore or too fast. Retrying')
-                time.sleep(5)
-                continue
-            try:
-                proxy_ip = r.json()['data'][0]['ip']
-                proxy_port = r.json()['data'][0]['port']
-                good_proxies = proxy_ip + ':' + str(proxy_port)
-                good_proxies = {"http": good_proxies, "https": good_proxies}
+            proxies = self.get_proxies_zhima(1)
+            if proxies:
+                good_proxies = proxies[0][0]
                 logging.info('Zhima get proxy, using proxy: %s', good_proxies)
-                return header, good_proxies
-            except:
-                logging.warning('No Zhima Proxy now. Retrying')
-                time.sleep(5)
+                return self.get_ua(), good_proxies
+            time.sleep(5)
+
+    def get_proxies_zhima(self, num):
+        """
+        Lease num ips in one call
+        :return: [(proxy, expire_ts), ...], expire_ts is None if unknown
+        """
+        url = 'http://webapi.http.zhimacangku.com/getip?num=' + str(num) + '&type=2&pro=0' \
+              '&city=0&yys=0&port=11&pack=8241&ts=1&ys=0&cs=0&lb=1&sb=0&pb=4&mr=1&regions='
+        try:
+            r = requests.get(url, headers=self.get_ua(), timeout=5)
+            r_js = r.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.warning('Zhima Proxy error: %s', e)
+            return []
+        logging.warning('Zhima Proxy: %s', r_js)
+        if not r_js.get('data'):
+            logging.warning('No Zhima Proxy anymore or too fast')
+            return []
+        proxies = []
+        for data in r_js['data']:
+            try:
+                good_proxies = data['ip'] + ':' + str(data['port'])
+            except (KeyError, TypeError):
                 continue
+            expire_ts = None
+            if data.get('expire_time'):
+                expire_ts = time.mktime(time.strptime(data['expire_time'], '%Y-%m-%d %H:%M:%S'))
+            proxies.append(({"http": good_proxies, "https": good_proxies}, expire_ts))
+        return proxies
+
+    def get_proxies_redis(self, num):
+        """
+        Draw num proxies from redis proxy pool
+        :return: [(proxy, None), ...]
+        """
+        # srandmember with count and scard share one round trip
+        good_proxies_list, pool_size = self.client.pipeline().srandmember("good_proxies", num).scard("good_proxies").\
+            execute()
+        logging.info('Drew %s proxies from redis pool of %s', len(good_proxies_list), pool_size)
+        proxies = []
+        for good_proxies in good_proxies_list:
+            good_proxies = good_proxies.decode("utf-8")  # byte to str
+            proxies.append(({"http": good_proxies, "https": good_proxies}, None))
+        return proxies
 
     @staticmethod
     def get_ua():
@@ -97,6 +145,208 @@ class Proxy(object):
         return ua
 
 
+class ProxyValidator(object):
+    """
+    Validate many candidate proxies at once with a cheap HTTP probe of JD price endpoint,
+    instead of one browser page load per proxy like Proxy.check_jd
+    """
+    PROBE_ITEM_ID = '5089253'  # Iphone X
+
+    def __init__(self, concurrency=200, timeout=3):
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def _probe(self, cr, proxy):
+        start = time.time()
+        price = await cr.get_price_jd(self.PROBE_ITEM_ID, Proxy.get_ua(), proxy)
+        if price and price != '-1':
+            return proxy, time.time() - start
+        logging.info('Validate proxy failure: %s', proxy)
+        return proxy, None
+
+    async def validate_async(self, proxies):
+        # every proxy gets its own connection, so the per host limit is the concurrency itself
+        async with AsyncCrawler(self.concurrency, self.concurrency, self.timeout) as cr:
+            results = await asyncio.gather(*[self._probe(cr, proxy) for proxy in proxies])
+        return [(proxy, latency) for proxy, latency in results if latency is not None]
+
+    def validate(self, proxies):
+        """
+        :param proxies: [{"http": ..., "https": ...}, ...]
+        :return: [(proxy, latency), ...] of valid proxies
+        """
+        if not proxies:
+            return []
+        loop = asyncio.new_event_loop()
+        try:
+            valid = loop.run_until_complete(self.validate_async(proxies))
+        finally:
+            loop.close()
+        logging.info('Validated proxies: %s/%s valid', len(valid), len(proxies))
+        return valid
+
+    def validate_to_redis(self, proxies, client, key='good_proxies'):
+        """
+        Validate proxies and write the results back to the redis set: add valid ones, remove invalid ones
+        :return: [(proxy, latency), ...] of valid proxies
+        """
+        valid = self.validate(proxies)
+        valid_keys = {proxy['https'] for proxy, latency in valid}
+        invalid_keys = {proxy['https'] for proxy in proxies} - valid_keys
+        pipe = client.pipeline()
+        if valid_keys:
+            pipe.sadd(key, *valid_keys)
+        if invalid_keys:
+            pipe.srem(key, *invalid_keys)
+        pipe.execute()
+        return valid
+
+
+class ProxyEntry(object):
+    # success rate and latency are EWMA, new proxy starts with full success rate
+    def __init__(self, proxy, expire_ts):
+        self.proxy = proxy
+        self.expire_ts = expire_ts
+        self.success_rate = 1.0
+        self.latency = None
+        self.uses = 0
+
+    def score(self):
+        return self.success_rate / (1 + (self.latency or 0))
+
+    def update(self, success, latency, alpha):
+        self.uses += 1
+        self.success_rate = (1 - alpha) * self.success_rate + alpha * (1.0 if success else 0.0)
+        if success and latency is not None:
+            self.latency = latency if self.latency is None else (1 - alpha) * self.latency + alpha * latency
+
+
+class ProxyManager(object):
+    """
+    In-process warm buffer of validated proxies
+    Proxies are scored by EWMA success rate and latency, get() picks one of the top_k weighted by score,
+    so workers spread over several IPs, a background thread drops expired or failing proxies and refills the buffer
+    """
+
+    def __init__(self, source, validator=None, min_size=5, max_size=20, ttl=300, alpha=0.3, min_success=0.3,
+                 oversample=3, top_k=3):
+        """
+        :param source: source(num) -> [(proxy, expire_ts), ...], e.g. Proxy().get_proxies_redis
+        :param validator: validator(proxies) -> [(proxy, latency), ...] of valid ones, e.g. ProxyValidator().validate,
+                          None to skip validation
+        :param ttl: lifetime of proxy without expire_ts
+        :param min_success: proxy is dropped when success rate is lower
+        :param oversample: draw this times of needed proxies from source when validating, most free proxies fail
+        :param top_k: get() chooses among this many best scored proxies
+        """
+        self.source = source
+        self.validator = validator
+        self.min_size = min_size
+        self.max_size = max_size
+        self.ttl = ttl
+        self.alpha = alpha
+        self.min_success = min_success
+        self.oversample = oversample
+        self.top_k = top_k
+        self._entries = {}  # proxy address: ProxyEntry
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(proxy):
+        return proxy['https']
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop, name='proxy-refill', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.expire_ts <= now or entry.success_rate < self.min_success:
+                    logging.info('Drop proxy: %s, success rate %.2f', key, entry.success_rate)
+                    del self._entries[key]
+
+    def refill(self):
+        self._evict()
+        need = self.min_size - len(self._entries)
+        if need <= 0:
+            return 0
+        candidates = {self._key(proxy): (proxy, expire_ts)
+                      for proxy, expire_ts in self.source(need * self.oversample if self.validator else need)
+                      if self._key(proxy) not in self._entries}
+        if self.validator:
+            valid = self.validator([proxy for proxy, expire_ts in candidates.values()])
+        else:
+            valid = [(proxy, None) for proxy, expire_ts in candidates.values()]
+        for proxy, latency in valid:
+            self.add(proxy, candidates[self._key(proxy)][1], latency)
+        return len(valid)
+
+    def add(self, proxy, expire_ts=None, latency=None):
+        with self._not_empty:
+            if len(self._entries) >= self.max_size:
+                return
+            entry = ProxyEntry(proxy, expire_ts or time.time() + self.ttl)
+            entry.latency = latency
+            self._entries[self._key(proxy)] = entry
+            self._not_empty.notify_all()
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.refill() and len(self._entries) < self.min_size:
+                    self._stop.wait(5)  # source is empty or too fast
+            except Exception as e:
+                logging.warning('Refill proxy error: %s', e)
+                self._stop.wait(5)
+            self._stop.wait(1)
+
+    @timed('proxy_acquire')
+    def get(self, timeout=None):
+        """
+        :return: a valid proxy {"http": ..., "https": ...} of the top_k, chosen with probability by score,
+                 None if timeout
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._not_empty:
+            while True:
+                now = time.time()
+                entries = [entry for entry in self._entries.values()
+                           if entry.expire_ts > now and entry.success_rate >= self.min_success]
+                if entries:
+                    best = sorted(entries, key=lambda entry: entry.score(), reverse=True)[:self.top_k]
+                    weights = [entry.score() for entry in best]
+                    if not any(weights):  # min_success is 0 and all of them failed
+                        return random.choice(best).proxy
+                    return random.choices(best, weights=weights)[0].proxy
+                remaining = deadline - now if deadline is not None else 5
+                if remaining <= 0:
+                    return None
+                logging.critical('No validated proxy in buffer, waiting')
+                self._not_empty.wait(remaining)
+
+    def report(self, proxy, success, latency=None):
+        """Feed back the result of a request made through proxy"""
+        if not proxy:
+            return
+        with self._lock:
+            entry = self._entries.get(self._key(proxy))
+            if entry is not None:
+                entry.update(success, latency, self.alpha)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     p = Proxy()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import heapq
+import logging
+import random
+import time
+from decimal import Decimal
+from metrics import observe, REGISTRY
+
+
+class Scheduler(object):
+    """
+    按下次到期时间排序的优先队列(heapq)，每个商品有自适应的抓取间隔：
+    价格波动或接近用户设定价格时缩短，价格稳定时逐渐延长
+    """
+
+    def __init__(self, interval, min_interval, max_interval, jitter=0.1, near_ratio=0.05):
+        """
+        :param interval: 新加入商品的抓取间隔
+        :param min_interval: 价格波动或接近设定价格时的最短间隔
+        :param max_interval: 价格稳定时的最长间隔
+        :param jitter: 到期时间的随机抖动比例，避免商品集中在同一时刻到期
+        :param near_ratio: 当前价格高于设定价格不超过该比例时视为接近设定价格
+        """
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.near_ratio = Decimal(str(near_ratio))
+        self._heap = []  # [(due_ts, key), ...]
+        self._due = {}  # key: due_ts, heap entries not matching it are stale
+        self._state = {}  # key: {interval, last_price, threshold}
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_avg = 0.0  # EWMA
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, key):
+        return key in self._due
+
+    def _push(self, key, due_ts):
+        self._due[key] = due_ts
+        heapq.heappush(self._heap, (due_ts, key))
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def add(self, key, due_ts=None, threshold=None):
+        """加入或更新商品，已存在的商品只更新设定价格"""
+        if key in self._due:
+            self._state[key]['threshold'] = threshold
+            return
+        self._state[key] = {'interval': self.interval, 'last_price': None, 'threshold': threshold}
+        self._push(key, due_ts if due_ts is not None else time.time())
+
+    def remove(self, key):
+        # heap entry is dropped lazily when popped
+        self._due.pop(key, None)
+        self._state.pop(key, None)
+
+    def sync(self, keys_due):
+        """
+        与数据库中仍在监控的商品同步
+        :param keys_due: {key: (due_ts, threshold)}
+        """
+        for key in list(self._due):
+            if key not in keys_due:
+                self.remove(key)
+        for key, (due_ts, threshold) in keys_due.items():
+            self.add(key, due_ts, threshold)
+
+    def next_due_in(self, now=None):
+        """距下一个商品到期的秒数，没有商品时为 None"""
+        now = now or time.time()
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)  # stale entry
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - now)
+
+    def pop_due(self, limit=None, now=None):
+        """
+        取出所有已到期的商品（最多 limit 个），并记录调度延迟
+        :return: [key, ...]，按到期时间排序
+        """
+        now = now or time.time()
+        keys = []
+        while self._heap and (limit is None or len(keys) < limit):
+            due_ts, key = self._heap[0]
+            if self._due.get(key) != due_ts:
+                heapq.heappop(self._heap)  # stale entry
+                continue
+            if due_ts > now:
+                break
+            heapq.heappop(self._heap)
+            del self._due[key]
+            self._record_lag(now - due_ts)
+            keys.append(key)
+        return keys
+
+    def _record_lag(self, lag):
+        self.lag_last = lag
+        self.lag_max = max(self.lag_max, lag)
+        self.lag_avg = lag if not self.lag_avg else 0.9 * self.lag_avg + 0.1 * lag
+        observe('loop_lag_seconds', lag)
+
+    def reschedule(self, key, price=None, now=None):
+        """
+        抓取完成后按本次价格重新计算间隔并放回队列
+        :param price: 本次抓取的价格，None 表示抓取失败
+        """
+        state = self._state.get(key)
+        if state is None:  # removed while crawling
+            return
+        now = now or time.time()
+        price = Decimal(str(price)) if price else None
+        interval = state['interval']
+        if price is None:
+            interval = self.interval  # retry with the default interval
+        elif state['last_price'] is not None and price != state['last_price']:
+            interval = max(self.min_interval, interval / 2)  # volatile
+        else:
+            interval = min(self.max_interval, interval * 1.5)  # stable
+        threshold = state['threshold']
+        if price is not None and threshold and price <= threshold * (1 + self.near_ratio):
+            interval = self.min_interval  # close to user price
+        state['interval'] = interval
+        if price is not None:
+            state['last_price'] = price
+        self._push(key, now + self._jittered(interval))
+
+    def due_at(self, key):
+        """商品的下次到期时间，不在队列中时为 None"""
+        return self._due.get(key)
+
+    def defer(self, key, due_ts):
+        """商品本轮由其他节点抓取，间隔不变，到 due_ts 再尝试"""
+        if key in self._state:
+            self._push(key, due_ts)
+
+    def report(self):
+        REGISTRY.set('scheduled_items', len(self))
+        logging.warning('Scheduler: %s items, lag last %.1fs, avg %.1fs, max %.1fs',
+                        len(self), self.lag_last, self.lag_avg, self.lag_max)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import fnmatch
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+
+LOGIN_TTL = 1800  # seconds a successful login check is trusted
+REFRESH_AGE = 24 * 3600  # rewrite an unchanged cookie file after this, to keep expiry dates fresh
+# tracking cookies rewritten by every page view, a change of them alone is not worth a write
+VOLATILE_COOKIES = ('__jd*', 'shshshfp*', '3AB9D23F7A4B3CSS', 'jsavif', 'unpl')
+
+
+class CookieSession(object):
+    """
+    Login state and cookie file shared by all crawlers using the same cookies file
+    - the login is checked at most once per ttl, while crawling one crawler checks it again after ttl,
+      a redirect to the login page invalidates it
+    - cookies are written only when a non volatile cookie changed (hash of domain, path, name, value),
+      or when the file is older than refresh_age
+    - the file is written to a temp file and renamed over the old one, a crash never leaves it half written
+    """
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, path, ttl=LOGIN_TTL, refresh_age=REFRESH_AGE):
+        self.path = path
+        self.ttl = ttl
+        self.refresh_age = refresh_age
+        self._lock = threading.Lock()
+        self._valid_ts = 0  # time of last successful login check
+        self._hash = None  # hash of cookies in the file
+        self._saved_ts = 0
+
+    @classmethod
+    def get(cls, path):
+        """The session of a cookies file, one per absolute path in this process"""
+        key = os.path.abspath(path)
+        with cls._sessions_lock:
+            session = cls._sessions.get(key)
+            if session is None:
+                session = cls._sessions[key] = cls(path)
+            return session
+
+    @staticmethod
+    def digest(cookies):
+        stable = sorted((c.get('domain', ''), c.get('path', ''), c['name'], c.get('value', ''))
+                        for c in cookies
+                        if not any(fnmatch.fnmatchcase(c['name'], pattern) for pattern in VOLATILE_COOKIES))
+        return hashlib.sha1(repr(stable).encode('utf-8')).hexdigest()
+
+    def load(self):
+        """:return: unexpired cookies of the file, [] if there is no file"""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            cookies = pickle.load(f) or []
+        with self._lock:
+            self._hash = self.digest(cookies)
+            self._saved_ts = os.path.getmtime(self.path)
+        now = time.time()
+        return [c for c in cookies if not ('expiry' in c and c['expiry'] < now)]
+
+    def save(self, cookies, force=False):
+        """
+        :return: True if the file was written, False if the cookies are unchanged or empty
+        """
+        if not cookies:
+            return False
+        digest = self.digest(cookies)
+        with self._lock:
+            if not force and digest == self._hash and time.time() - self._saved_ts < self.refresh_age:
+                return False
+            tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(cookies, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._hash = digest
+            self._saved_ts = time.time()
+        logging.info('Cookies saved to %s', self.path)
+        return True
+
+    def remove(self):
+        """Drop an invalid cookies file"""
+        with self._lock:
+            self._hash = None
+            self._valid_ts = 0
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    @property
+    def login_valid(self):
+        """True if the login was confirmed within ttl, no check needed"""
+        return time.time() - self._valid_ts < self.ttl
+
+    def claim_recheck(self):
+        """True for one caller once a confirmed login is older than ttl, that caller checks the login again"""
+        with self._lock:
+            if self._valid_ts and not self.login_valid:
+                self._valid_ts = time.time()  # other crawlers keep trusting it while one checks
+                return True
+            return False
+
+    def mark_valid(self):
+        self._valid_ts = time.time()
+
+    def invalidate(self):
+        self._valid_ts = 0
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# coding=utf-8
+import json
+import logging
+import os
+import threading
+
+
+class StateStore(object):
+    """
+    Embedded key-value store of monitor state: an append-only log of json lines plus periodic compaction
+    set() appends one line, O(1) whatever the number of keys; a torn last line after a crash is ignored on load;
+    compaction writes a snapshot to a temp file and renames it over the log atomically
+    """
+
+    def __init__(self, path, compact_min=1000, compact_ratio=2):
+        """
+        :param compact_min: never compact a log shorter than this many lines
+        :param compact_ratio: compact when log lines > compact_ratio * live keys
+        """
+        self.path = path
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self._data = {}  # namespace: {key: value}
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):  # torn write of last line
+                    logging.warning('State store drop torn last line: %r', line[:100])
+                    break
+                valid_size += len(line)
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    logging.warning('State store ignore broken line: %r', line[:100])
+                    continue
+                self._apply(record)
+                self._lines += 1
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def _apply(self, record):
+        namespace = self._data.setdefault(record['ns'], {})
+        if record.get('del'):
+            namespace.pop(record['k'], None)
+        else:
+            namespace[record['k']] = record['v']
+
+    def _append(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(record)
+            self._lines += 1
+            if self._lines > max(self.compact_min, self.compact_ratio * len(self)):
+                self._compact()
+
+    def __len__(self):
+        return sum(len(namespace) for namespace in self._data.values())
+
+    def get(self, ns, key, default=None):
+        return self._data.get(ns, {}).get(key, default)
+
+    def items(self, ns):
+        """Copy of all keys in namespace, {key: value}"""
+        return dict(self._data.get(ns, {}))
+
+    def set(self, ns, key, value):
+        namespace = self._data.get(ns, {})
+        if key in namespace and namespace[key] == value:
+            return
+        self._append({'ns': ns, 'k': key, 'v': value})
+
+    def delete(self, ns, key):
+        if key in self._data.get(ns, {}):
+            self._append({'ns': ns, 'k': key, 'del': 1})
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for ns, namespace in self._data.items():
+                for key, value in namespace.items():
+                    f.write(json.dumps({'ns': ns, 'k': key, 'v': value}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._lines = len(self)
+        logging.info('State store compacted: %s keys', self._lines)
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
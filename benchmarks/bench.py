@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Offline benchmark of the crawl, parse, database and alert stages, JD is replaced by the local stub server
+
+    python benchmarks/bench.py                            # run, compare with benchmarks/baseline.json
+    python benchmarks/bench.py --save-baseline            # run, save results as the new baseline
+    python benchmarks/bench.py --latency 0.05 --error-rate 0.05 --selenium
+
+Every stage reports items per second and per-call latency (mean, p50, p95).
+Exit status is 1 when a stage is slower than the baseline by more than --threshold.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'PriceMonitor'))
+
+from stub_server import StubServer, fake_item  # noqa: E402
+from crawler_js import Crawler, NAME_FAILURE  # noqa: E402
+from crawler_async import crawl_items_info  # noqa: E402
+from CONFIG import DB_BATCH_SIZE, SCHEDULE_BATCH_SIZE  # noqa: E402
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+HEADER = {'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+                        'Chrome/135.0.7049.95 Safari/537.36'}
+MIN_CALLS_P95 = 20  # p95 of fewer calls is too noisy to flag regressions
+URL_BUILDERS = ('url_info_huihui', 'url_subtitle_jd', 'url_prices_jd', 'url_name_jd')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Stage(object):
+    """Timings of one benchmark stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []  # seconds of every call
+        self.items = 0
+        self.failures = 0
+
+    @contextmanager
+    def measure(self, items=1):
+        start = time.perf_counter()
+        yield
+        self.latencies.append(time.perf_counter() - start)
+        self.items += items
+
+    def result(self):
+        elapsed = sum(self.latencies)
+        return {'calls': len(self.latencies), 'items': self.items, 'failures': self.failures,
+                'elapsed_s': round(elapsed, 4),
+                'items_per_s': round(self.items / elapsed, 2) if elapsed else 0.0,
+                'mean_ms': round(elapsed / len(self.latencies) * 1000, 3) if self.latencies else 0.0,
+                'p50_ms': round(percentile(self.latencies, 0.5) * 1000, 3),
+                'p95_ms': round(percentile(self.latencies, 0.95) * 1000, 3)}
+
+
+@contextmanager
+def stub_routing(stub):
+    """Point the url builders of crawler_js (shared by crawler_async) at the stub server"""
+    originals = {name: getattr(Crawler, name) for name in URL_BUILDERS}
+    for name, builder in originals.items():
+        setattr(Crawler, name, staticmethod(lambda *args, _builder=builder: stub.rewrite(_builder(*args))))
+    try:
+        yield
+    finally:
+        for name, builder in originals.items():
+            setattr(Crawler, name, staticmethod(builder))
+
+
+def bench_js(item_ids, rounds):
+    prices, names, huihui = Stage('js_prices'), Stage('js_name'), Stage('js_huihui')
+    for _ in range(rounds):
+        with prices.measure(len(item_ids)):
+            result = Crawler.get_prices_jd(item_ids, HEADER)
+        prices.failures += sum(1 for price in result.values() if price is False)
+        for item_id in item_ids:
+            with names.measure():
+                name = Crawler.get_name_jd(item_id, HEADER)
+            names.failures += name in ('', NAME_FAILURE)
+            with huihui.measure():
+                try:
+                    info = Crawler.get_info_huihui(item_id, HEADER)
+                except ValueError:  # captcha page is not json
+                    info = False
+            huihui.failures += info is False
+    return [prices, names, huihui]
+
+
+def bench_async(item_ids, rounds):
+    stage = Stage('async_items_info')
+    for _ in range(rounds):
+        for i in range(0, len(item_ids), SCHEDULE_BATCH_SIZE):
+            batch = item_ids[i:i + SCHEDULE_BATCH_SIZE]
+            with stage.measure(len(batch)):
+                items_info = crawl_items_info(batch, HEADER)
+            stage.failures += sum(1 for item_info in items_info.values()
+                                  if item_info['price'] is False or item_info['title'] in ('', NAME_FAILURE))
+    return [stage]
+
+
+def bench_parse(stub, item_ids, rounds):
+    stage = Stage('parse_name')
+    pages = [stub.render('item_page.html', item_id) for item_id in item_ids]
+    for _ in range(rounds):
+        for page in pages:
+            with stage.measure():
+                name = Crawler.parse_name_jd(page)
+            stage.failures += name == NAME_FAILURE
+    return [stage]
+
+
+def bench_selenium(stub, item_ids, lean):
+    stage = Stage('selenium_item')
+    try:
+        from crawler_selenium import Crawler as Browser
+        browser = Browser(skip_cookies=True, standalone=True, lean=lean)
+    except Exception as e:
+        print('Skip selenium stage, Chrome not available: %s' % e)
+        return []
+    try:
+        for item_id in item_ids:
+            with stage.measure():
+                item_info = browser.get_jd_item(stub.rewrite(Crawler.url_name_jd(item_id)))
+            stage.failures += not item_info['price']
+    finally:
+        browser.quit()
+    return [stage]
+
+
+def bench_db(item_ids, rounds, monitors_per_item):
+    """Write path of one crawl round (update_items, write_price_history) and the alert pass, on a new SQLite file"""
+    logging.disable(logging.INFO)
+    with redirect_stdout(io.StringIO()):  # Sql engine is created with echo=True
+        from conn_sql import Sql
+        Sql.engine.echo = False
+    logging.disable(logging.NOTSET)
+    from create_db import Base, User, Monitor, to_price
+    Base.metadata.create_all(Sql.engine)
+    sq = Sql()
+    sq.session.add(User(user_name='bench', email='bench@example.com'))
+    sq.session.commit()
+    user_id = sq.session.query(User.column_id).filter(User.user_name == 'bench').scalar()
+    column_ids = {}
+    for n, item_id in enumerate(item_ids):
+        price = to_price(fake_item(item_id)['price'])
+        for k in range(monitors_per_item):
+            user_price = price + 1 if (n + k) % 5 == 0 else price / 2  # one in five monitors alerts
+            monitor = Monitor(item_id=int(item_id), user_price=user_price, user_id=user_id, status=True)
+            sq.session.add(monitor)
+            sq.session.flush()
+            column_ids.setdefault(item_id, []).append(monitor.column_id)
+    sq.session.commit()
+
+    update, history, alert = Stage('db_update_items'), Stage('db_price_history'), Stage('alert_pass')
+    for r in range(rounds):
+        items_info, prices = {}, {}
+        for item_id in item_ids:
+            info = fake_item(item_id)
+            price = to_price(info['price']) + r % 2  # every other round changes all prices
+            prices[item_id] = price
+            for column_id in column_ids[item_id]:
+                items_info[column_id] = {'item_name': info['name'], 'item_price': price,
+                                         'highest_price': info['max_price'], 'lowest_price': info['min_price']}
+        batch_ids = list(items_info)
+        for i in range(0, len(batch_ids), DB_BATCH_SIZE):
+            batch = {column_id: items_info[column_id] for column_id in batch_ids[i:i + DB_BATCH_SIZE]}
+            with update.measure(len(batch)):
+                sq.update_items(batch)
+        with history.measure(len(prices)):
+            sq.write_price_history(prices, ts=int(time.time()) + r)
+        for i in range(0, len(item_ids), SCHEDULE_BATCH_SIZE):
+            batch = item_ids[i:i + SCHEDULE_BATCH_SIZE]
+            with alert.measure(len(batch)):
+                sq.check_item_need_to_remind(batch)
+    return [update, history, alert]
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: [(stage, message), ...] of regressions
+    """
+    regressions = []
+    for name, result in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if not base:
+            continue
+        if base['items_per_s'] and result['items_per_s'] < base['items_per_s'] * (1 - threshold):
+            regressions.append((name, 'items/s %.1f -> %.1f' % (base['items_per_s'], result['items_per_s'])))
+        if result['calls'] >= MIN_CALLS_P95 and base['p95_ms'] and \
+                result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append((name, 'p95 %.1fms -> %.1fms' % (base['p95_ms'], result['p95_ms'])))
+    return regressions
+
+
+def print_results(results, baseline):
+    print('%-18s %8s %8s %10s %10s %10s %10s %9s' % ('stage', 'calls', 'items', 'items/s', 'mean ms', 'p50 ms',
+                                                     'p95 ms', 'failures'))
+    for name, result in results['stages'].items():
+        line = '%-18s %8s %8s %10.1f %10.2f %10.2f %10.2f %9s' % (
+            name, result['calls'], result['items'], result['items_per_s'], result['mean_ms'], result['p50_ms'],
+            result['p95_ms'], result['failures'])
+        base = baseline['stages'].get(name) if baseline else None
+        if base and base['items_per_s']:
+            line += '  (%+.0f%% items/s)' % ((result['items_per_s'] / base['items_per_s'] - 1) * 100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of crawl, parse, database and alert stages')
+    parser.add_argument('--items', type=int, default=100, help='distinct item ids')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--monitors-per-item', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of stub responses that fail')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--selenium', action='store_true', help='also run get_jd_item in Chrome')
+    parser.add_argument('--selenium-items', type=int, default=10)
+    parser.add_argument('--lean', action='store_true', help='Chrome in lean page-load mode')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.3, help='allowed slowdown against baseline')
+    parser.add_argument('--output', help='also write results json to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the work dir with the sqlite file')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    item_ids = [str(100000000000 + i * 7919) for i in range(args.items)]
+    stub = StubServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed).start()
+    stages = []
+    workdir = tempfile.mkdtemp(prefix='pricemonitor-bench-')
+    cwd = os.getcwd()
+    os.chdir(workdir)  # conn_sql opens sqlite:///db_demo.db, cookies are saved here too
+    try:
+        with stub_routing(stub):
+            stages += bench_js(item_ids, args.rounds)
+            stages += bench_async(item_ids, args.rounds)
+            stages += bench_parse(stub, item_ids, args.rounds)
+            if args.selenium:
+                stages += bench_selenium(stub, item_ids[:args.selenium_items], args.lean)
+        stages += bench_db(item_ids, args.rounds, args.monitors_per_item)
+    finally:
+        os.chdir(cwd)
+        stub.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {'params': {'items': args.items, 'rounds': args.rounds, 'monitors_per_item': args.monitors_per_item,
+                          'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate},
+               'env': {'python': platform.python_version(), 'platform': platform.platform()},
+               'stub': {'requests': stub.requests, 'injected_errors': stub.injected},
+               'stages': {stage.name: stage.result() for stage in stages}}
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print('stub: %s requests, %s injected errors' % (stub.requests, stub.injected))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline saved: %s' % args.baseline)
+        return 0
+    if baseline is None:
+        print('No baseline at %s, run with --save-baseline first' % args.baseline)
+        return 0
+    if baseline['params'] != results['params']:
+        print('Warning: parameters differ from baseline %s' % baseline['params'])
+    regressions = compare(results, baseline, args.threshold)
+    for name, message in regressions:
+        print('REGRESSION %s: %s' % (name, message))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
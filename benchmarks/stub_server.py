@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""
+Local HTTP stub of the JD endpoints used by the crawlers, for offline benchmarks
+
+Requests are routed by the original host as the first path segment:
+    https://p.3.cn/prices/mgets?skuIds=J_1  ->  http://127.0.0.1:<port>/p.3.cn/prices/mgets?skuIds=J_1
+
+Responses are built from the templates in fixtures/, a recorded page saved as fixtures/item_<item_id>.html
+is served as is for that item. Latency and errors are injected per request.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ERROR_KINDS = ('503', 'captcha', 'reset')
+
+
+def fake_item(item_id):
+    # deterministic fields of an item, used to fill the templates
+    item_id = str(item_id)
+    price = 100 + (int(item_id) if item_id.isdigit() else 0) % 9000
+    return {'item_id': item_id, 'name': '测试商品 %s 全网通 8GB+256GB' % item_id, 'subtitle': '限时优惠，下单立减',
+            'price': '%.2f' % price, 'max_price': '%.2f' % (price * 1.2), 'min_price': '%.2f' % (price * 0.9)}
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # default 5 drops connections of the async crawler, adding 1s SYN retries
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, errors=ERROR_KINDS, seed=None,
+                 fixtures_dir=FIXTURES_DIR):
+        """
+        :param port: 0 picks a free port
+        :param latency: seconds added to every response
+        :param jitter: latency is uniform in [latency - jitter, latency + jitter]
+        :param error_rate: share of requests answered with an error picked from errors
+        :param errors: '503' status, 'captcha' page or connection 'reset'
+        """
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = errors
+        self.random = random.Random(seed)
+        self.fixtures_dir = fixtures_dir
+        self.templates = {}
+        for name in ('item_page.html', 'huihui.json', 'subtitle.json', 'captcha.html'):
+            with open(os.path.join(fixtures_dir, name), encoding='utf-8') as f:
+                self.templates[name] = f.read()
+        self.requests = 0
+        self.injected = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def rewrite(self, url):
+        """Original https url to the stub url"""
+        parts = urlsplit(url)
+        return self.base_url + '/' + parts.netloc + parts.path + ('?' + parts.query if parts.query else '')
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def render(self, name, item_id):
+        text = self.templates[name]
+        for key, value in fake_item(item_id).items():
+            text = text.replace('{%s}' % key, value)
+        return text
+
+    def recorded_page(self, item_id):
+        path = os.path.join(self.fixtures_dir, 'item_%s.html' % item_id)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+        return None
+
+    def draw(self):
+        """:return: (delay seconds, injected error kind or None)"""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            error = None
+            if self.error_rate and self.random.random() < self.error_rate:
+                error = self.random.choice(self.errors)
+                self.injected += 1
+        return delay, error
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real endpoints
+    # headers and body are separate writes, with Nagle every reused connection waits for a delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug('Stub: ' + format, *args)
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        delay, error = server.draw()
+        if delay:
+            time.sleep(delay)
+        if error == 'reset':
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))  # RST on close
+            self.close_connection = True
+            return
+        if error == '503':
+            return self._send(503, 'Service Unavailable')
+        if error == 'captcha':
+            return self._send(200, server.templates['captcha.html'])
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        query = parse_qs(parts.query)
+        if host == 'p.3.cn':
+            item_ids = [sku[2:] for sku in query.get('skuIds', [''])[0].split(',') if sku.startswith('J_')]
+            if not item_ids:
+                return self._send(200, 'skuids input error\n', 'text/plain; charset=utf-8')
+            prices = [{'id': 'J_' + item_id, 'p': fake_item(item_id)['price'], 'm': fake_item(item_id)['max_price'],
+                       'op': fake_item(item_id)['price']} for item_id in item_ids]
+            return self._send(200, '(' + json.dumps(prices) + ');\n', 'application/javascript; charset=utf-8')
+        if host == 'zhushou.huihui.cn':
+            item_id = query.get('phu', [''])[0].rsplit('/', 1)[-1].split('.')[0]
+            return self._send(200, server.render('huihui.json', item_id), 'application/json; charset=utf-8')
+        if host == 'cd.jd.com':
+            item_id = query.get('skuId', [''])[0]
+            item_id = item_id[:-len('5181380')] if item_id.endswith('5181380') else item_id  # see url_subtitle_jd
+            text = 'jQuery6525446(' + server.render('subtitle.json', item_id) + ')'
+            return self._send(200, text, 'application/javascript; charset=utf-8')
+        if host == 'item.jd.com':
+            item_id = path.split('.')[0]
+            page = server.recorded_page(item_id) or server.render('item_page.html', item_id)
+            return self._send(200, page)
+        self._send(404, 'Not Found')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve JD fixtures locally')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    stub = StubServer(args.port, args.latency, args.jitter, args.error_rate)
+    print('Serving on %s, e.g. %s' % (stub.base_url, stub.rewrite('https://item.jd.com/100038005189.html')))
+    stub.serve_forever()
@@ -1,53 +1,83 @@
-from PriceMonitor.crawler_selenium import Crawler
+from PriceMonitor.crawler_selenium import Crawler, CrawlerPool
+from PriceMonitor.outbox import Outbox
+from PriceMonitor.state_store import StateStore
+from PriceMonitor.metrics import REGISTRY, start_http_server
+from PriceMonitor.profiler import RoundProfiler
+from PriceMonitor.session import CookieSession
 import time
 import json
 import datetime
 import re
 import concurrent.futures
 import os
-import pickle
+from decimal import Decimal
 
 LAST_MONITOR_STATUS_FILE = "last_monitor_status.json"
+MONITOR_STATE_FILE = "last_monitor_status.log"
+NOTICE_OUTBOX_FILE = "notice_outbox.db"
+
+notice_outbox = None
+monitor_state = None
+
+
+def get_notice_outbox():
+    """通知先写入磁盘上的发件箱，由后台线程批量发送并失败重试，不阻塞监控循环"""
+    global notice_outbox
+    if notice_outbox is None:
+        notice_outbox = Outbox(NOTICE_OUTBOX_FILE).start()
+    return notice_outbox
+
+def get_monitor_state():
+    """监控状态保存在追加写入的日志中，每次价格或优惠券变化只追加一行，不再整体重写 json 文件"""
+    global monitor_state
+    if monitor_state is None:
+        monitor_state = StateStore(MONITOR_STATE_FILE)
+        if not len(monitor_state) and os.path.exists(LAST_MONITOR_STATUS_FILE):
+            # 首次运行时导入旧版 last_monitor_status.json
+            try:
+                with open(LAST_MONITOR_STATUS_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for url, price in data.get("last_prices", {}).items():
+                    monitor_state.set("last_prices", url, price)
+                for url, status in data.get("last_coupon_status", {}).items():
+                    monitor_state.set("last_coupon_status", url, status)
+            except Exception as e:
+                print(f"导入{LAST_MONITOR_STATUS_FILE}失败: {e}")
+    return monitor_state
 
 def load_monitor_status():
     try:
-        with open(LAST_MONITOR_STATUS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            last_prices = data.get("last_prices", {})
-            last_coupon_status = data.get("last_coupon_status", {})
-            return last_prices, last_coupon_status
+        state = get_monitor_state()
+        return state.items("last_prices"), state.items("last_coupon_status")
     except Exception:
         return {}, {}
 
-def save_last_prices(last_prices):
+def save_last_price(url, price):
     try:
-        data = {}
-        if os.path.exists(LAST_MONITOR_STATUS_FILE):
-            with open(LAST_MONITOR_STATUS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        data["last_prices"] = last_prices
-        with open(LAST_MONITOR_STATUS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        get_monitor_state().set("last_prices", url, price)
     except Exception as e:
         print(f"保存last_prices失败: {e}")
 
-def save_last_coupon_status(last_coupon_status):
+def save_last_coupon_status(url, coupon_status):
     try:
-        data = {}
-        if os.path.exists(LAST_MONITOR_STATUS_FILE):
-            with open(LAST_MONITOR_STATUS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        data["last_coupon_status"] = last_coupon_status
-        with open(LAST_MONITOR_STATUS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        get_monitor_state().set("last_coupon_status", url, coupon_status)
     except Exception as e:
         print(f"保存last_coupon_status失败: {e}")
 
+def apply_cookies(crawler, cookies):
+    """把已保存的 cookies 注入到浏览器中并验证登录状态，登录状态有效期内只有第一个 worker 打开页面检查"""
+    crawler.add_cookies(cookies)
+    return crawler.check_login_status()
+
+
+def crawl_item(pool, url, profiler):
+    """从浏览器池借出一个 worker 抓取商品"""
+    with profiler.thread_scope(), pool.worker() as crawler:
+        return crawler.get_jd_item(url)
+
+
 def monitor():
     """使用已保存的 cookies 持续监控商品列表价格，每分钟获取一次，失败自动停止"""
-    # 创建一个新的爬虫实例，但不加载cookies
-    crawler = Crawler(skip_cookies=True)
-    
     # 用于存储每个商品的上次价格，用于检测价格变化
     last_prices, last_coupon_status = load_monitor_status()
     
@@ -62,12 +92,11 @@ def monitor():
     all_cookies = []
     print(f"\n尝试读取cookies {cookie_file}...")
     try:
-        with open(cookie_file, 'rb') as f:
-            cookies = pickle.load(f)
-            if cookies:
-                all_cookies.extend(cookies)
-            else:
-                print("cookie文件存在但没有内容")
+        cookies = CookieSession.get(cookie_file).load()
+        if cookies:
+            all_cookies.extend(cookies)
+        else:
+            print("cookie文件存在但没有内容")
     except Exception as e:
         print(f"读取cookies失败: {e}")
         return False
@@ -75,41 +104,17 @@ def monitor():
     # 检查是否成功加载了cookie
     if not all_cookies:
         print("\n未找到有效的cookies，请先登录并保存cookies")
-        crawler.quit()
         return False
     
-    # 先访问京东主页
-    crawler.chrome.get('https://www.jd.com')
-    time.sleep(1)
-    
-    # 添加所有cookie
-    for cookie in all_cookies:
-        try:
-            # 确保cookie有效
-            if 'expiry' in cookie and cookie['expiry'] < time.time():
-                continue
-            crawler.chrome.add_cookie(cookie)
-        except Exception as e:
-            continue
-    
-    # 刷新页面以应用cookies
-    crawler.chrome.refresh()
-    time.sleep(1)
-    
-    # 验证登录状态
-    if not crawler.check_login_status():
-        print("\ncookie已失效，请重新登录")
-        crawler.quit()
-        return False
-    else:
-        print("\n已成功使用cookies登录京东")
-    
     # 读取监控列表和间隔
     try:
         with open("monitor_items.json", "r", encoding="utf-8") as f:
             config = json.load(f)
             items = config.get("items", [])
             interval = config.get("interval", 60)  # 默认60秒
+            pool_size = config.get("pool_size", 1)  # 并行抓取的浏览器数量，默认1个
+            lean = config.get("lean", False)  # 精简加载：拦截图片字体视频和广告，只等待价格和优惠券节点
+            metrics_port = config.get("metrics_port", 0)  # 本地 Prometheus 指标端口，0 表示不开启
     except Exception as e:
         print(f"读取监控配置失败: {e}")
         return False
@@ -118,84 +123,109 @@ def monitor():
         print("监控列表为空，请先添加商品")
         return False
     
-    print(f"\n开始监控商品列表价格，每 {interval} 秒采集一次...")
+    # 每个 worker 是独立的浏览器，创建时各自注入 cookies 并验证登录
+    pool = CrawlerPool(pool_size, skip_cookies=True, cookies_file=cookie_file, lean=lean,
+                       setup=lambda crawler: apply_cookies(crawler, all_cookies))
     
-    while True:
-        for url in items:
-            try:
-                print(f"\n正在访问商品: {url}")
-                item_info = crawler.get_jd_item(url)
-                price = item_info['price']
-                title = item_info['title']
-                if title == "" or title is None:
-                    print(f"\n商品 {url} 未找到标题，跳过")
-                    send_jd_exception_notice("商品 {url} 标题未找到")
-                    continue
-                if price == "" or price is None:
-                    print(f"\n商品 {url} 未找到价格，跳过")
-                    send_jd_exception_notice("商品 {url} 价格未找到")
-                    continue
-                has_coupon = item_info['has_coupon']
-                coupon_detail_list = item_info['coupon_detail_list']
+    # 先创建一个 worker 验证登录状态
+    try:
+        pool.release(pool.acquire())
+    except RuntimeError:
+        print("\ncookie已失效，请重新登录")
+        pool.close()
+        return False
+    print("\n已成功使用cookies登录京东")
+    
+    print(f"\n开始监控商品列表价格，每 {interval} 秒采集一次，并行浏览器数: {pool_size}...")
+    start_http_server(metrics_port)
+    # 运行中 kill -USR1 <pid> 或创建 profile.ctl 文件（内容为轮数，可为空），分析接下来几轮的耗时和内存
+    profiler = RoundProfiler(pids_source=pool.pids)
+    profiler.install_signal()
+    
+    try:
+        while True:
+            profiler.begin_round()
+            for url, future in pool.imap_unordered(lambda url: crawl_item(pool, url, profiler), items):
+                try:
+                    print(f"\n已访问商品: {url}")
+                    item_info = future.result()
+                    price = item_info['price']
+                    title = item_info['title']
+                    if title == "" or title is None:
+                        print(f"\n商品 {url} 未找到标题，跳过")
+                        send_jd_exception_notice("商品 {url} 标题未找到")
+                        continue
+                    if price == "" or price is None:
+                        print(f"\n商品 {url} 未找到价格，跳过")
+                        send_jd_exception_notice("商品 {url} 价格未找到")
+                        continue
+                    has_coupon = item_info['has_coupon']
+                    coupon_detail_list = item_info['coupon_detail_list']
                 
-                if has_coupon:
-                    # 检查优惠券状态变化（新增或内容变化才推送）
-                    if (url not in last_coupon_status or
-                        last_coupon_status[url]['coupon_detail_list'] != coupon_detail_list):
-                        print(f"准备推送优惠券变化通知: {url}, {title}")
-                        send_jd_coupon_notice(url, title)
-                        last_coupon_status[url] = {
-                            'has_coupon': has_coupon,
-                            'coupon_detail_list': coupon_detail_list
-                        }
-                        save_last_coupon_status(last_coupon_status)
+                    if has_coupon:
+                        # 检查优惠券状态变化（新增或内容变化才推送）
+                        if (url not in last_coupon_status or
+                            last_coupon_status[url]['coupon_detail_list'] != coupon_detail_list):
+                            print(f"准备推送优惠券变化通知: {url}, {title}")
+                            send_jd_coupon_notice(url, title)
+                            last_coupon_status[url] = {
+                                'has_coupon': has_coupon,
+                                'coupon_detail_list': coupon_detail_list
+                            }
+                            save_last_coupon_status(url, last_coupon_status[url])
 
-                if price:
-                    # 检查是否有价格变化
+                    if price:
+                        # 检查是否有价格变化
 
-                    # 如果商品之前已经监控过（非第一次）
-                    if url in last_prices:
-                        # 如果价格发生了变化
-                        if last_prices[url] != price:
-                            # 创建价格变化状态信息
-                            old_price = last_prices[url]
-                            new_price = price
+                        # 如果商品之前已经监控过（非第一次）
+                        if url in last_prices:
+                            # 如果价格发生了变化
+                            if last_prices[url] != price:
+                                # 创建价格变化状态信息
+                                old_price = last_prices[url]
+                                new_price = price
                             
-                            # 比较价格变化方向
-                            if float(new_price) > float(old_price):
-                                change_direction = "上涨"
-                            else:
-                                change_direction = "下降"
-                            # 这里可以推送价格变化通知等...
-                            # 格式化status信息
-                            status = f"{change_direction}，原价格：{old_price}"
-                            print(f"价格变化！{url} 价格从 {old_price} 变为 {new_price}，{status}, 准备推送价格变化通知.")
-                            send_jd_price_change_notice(url, price, title, status)
+                                # 比较价格变化方向
+                                if Decimal(new_price) > Decimal(old_price):
+                                    change_direction = "上涨"
+                                else:
+                                    change_direction = "下降"
+                                # 这里可以推送价格变化通知等...
+                                # 格式化status信息
+                                status = f"{change_direction}，原价格：{old_price}"
+                                print(f"价格变化！{url} 价格从 {old_price} 变为 {new_price}，{status}, 准备推送价格变化通知.")
+                                send_jd_price_change_notice(url, price, title, status)
                             
+                                last_prices[url] = price
+                                save_last_price(url, price)
+                            # 如果价格没变，不做处理
+                        else:
+                            # 第一次检测也发送通知，状态为"初始化"
+                            status = f"初始采集价格：{price}"
+                            print(f"首次监控 {url}，价格: {price} 元，{status}, 准备推送价格变化通知.")
+                            send_jd_price_change_notice(url, price, title, status)
+                        
+                            # 第一次监控该商品，直接记录
                             last_prices[url] = price
-                            save_last_prices(last_prices)
-                        # 如果价格没变，不做处理
+                            save_last_price(url, price)
                     else:
-                        # 第一次检测也发送通知，状态为"初始化"
-                        status = f"初始采集价格：{price}"
-                        print(f"首次监控 {url}，价格: {price} 元，{status}, 准备推送价格变化通知.")
-                        send_jd_price_change_notice(url, price, title, status)
-                        
-                        # 第一次监控该商品，直接记录
-                        last_prices[url] = price
-                        save_last_prices(last_prices)
-                else:
+                        now = datetime.datetime.now()
+                        now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+                        print(f"[{now_str}] {url} 未找到价格")
+                except Exception as e:
                     now = datetime.datetime.now()
                     now_str = now.strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"[{now_str}] {url} 未找到价格")
-            except Exception as e:
-                now = datetime.datetime.now()
-                now_str = now.strftime("%Y-%m-%d %H:%M:%S")
-                print(f"[{now_str}] {url} 获取商品信息异常，跳过: {e}")
-                send_jd_exception_notice(f"{now_str}, {url}, 获取商品信息异常: {e}")
-                continue
-        time.sleep(interval)
+                    print(f"[{now_str}] {url} 获取商品信息异常，跳过: {e}")
+                    send_jd_exception_notice(f"{now_str}, {url}, 获取商品信息异常: {e}")
+                    continue
+            profiler.end_round()
+            # 本轮各阶段耗时和抓取结果统计
+            for line in REGISTRY.round_summary():
+                print(f"  {line}")
+            time.sleep(interval)
 
+    finally:
+        pool.close()
 
 def wait_for_login():
     """等待用户登录并保存 cookies"""
@@ -258,10 +288,9 @@ def send_jd_price_change_notice(url, price, title, status):
         
         print(f"发送价格变化通知: {payload}")
         
-        import requests
         api_url = "https://api.azzjia.com/common/SendJdPriceChangeNotice"
-        response = requests.post(api_url, json=payload, timeout=5)
-        print(f"价格变化通知发送结果: {response.status_code}")
+        if not get_notice_outbox().put(api_url, payload):
+            print("价格变化通知重复，已忽略")
             
     except Exception as e:
         print(f"处理价格变化通知时出错: {e}")
@@ -286,10 +315,9 @@ def send_jd_coupon_notice(url, title):
         
         print(f"发送优惠券变化通知: {payload}")
         
-        import requests
         api_url = "https://api.azzjia.com/common/SendJdCouponNotice"
-        response = requests.post(api_url, json=payload, timeout=5)
-        print(f"发送优惠券通知发送结果: {response.status_code}")
+        if not get_notice_outbox().put(api_url, payload):
+            print("优惠券通知重复，已忽略")
             
     except Exception as e:
         print(f"处理优惠券变化通知时出错: {e}")
@@ -303,10 +331,9 @@ def send_jd_exception_notice(exceiption):
         
         print(f"发送异常通知: 异常类型: {exceiption}")
         
-        import requests
         api_url = "https://api.azzjia.com/common/SendJdExceptionNotice"
-        response = requests.post(api_url, json=payload, timeout=5)
-        print(f"发送异常通知发送结果: {response.status_code}")
+        if not get_notice_outbox().put(api_url, payload):
+            print("异常通知重复，已忽略")
             
     except Exception as e:
         print(f"处理异常通知时出错: {e}")